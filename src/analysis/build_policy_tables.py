@@ -0,0 +1,65 @@
+
+from pathlib import Path
+from sys import path as sys_path
+
+project_root_path = Path(Path(__file__).parent, '..', '..')
+sys_path.append(str(project_root_path.resolve()))
+
+from time import (
+    perf_counter,
+)
+
+from src.config.config import (
+    Config,
+)
+from src.data.scheduling_data import (
+    SchedulingData,
+)
+from src.models.policy_snapshot import (
+    load_policy_network,
+)
+from src.models.numpy_policy import (
+    NumpyPolicy,
+)
+from src.models.lookup_table_policy import (
+    LookupTablePolicy,
+)
+
+
+def build_policy_table(
+        config: Config,
+        model_path: Path,  # saved PolicyNetwork, the table is written next to it
+) -> LookupTablePolicy:
+    """
+    Tabulate the actions of a saved policy over every state of the sim.
+    """
+
+    network = load_policy_network(model_path)
+    numpy_policy = NumpyPolicy.from_keras(network)
+
+    lookup_table_policy = LookupTablePolicy.from_sim(SchedulingData(config=config))
+
+    time_start = perf_counter()
+    lookup_table_policy.build_table(policy=numpy_policy, table_path=Path(model_path, 'policy_table.npy'))
+    config.logger.info(f'{model_path}: {lookup_table_policy.num_states} states tabulated '
+                       f'in {perf_counter() - time_start:.1f} s')
+
+    # spot check against the network
+    sample_states = lookup_table_policy.get_states(config.rng.integers(0, lookup_table_policy.num_states, 1_000))
+    numpy_policy.verify(network=network, states=sample_states)
+    max_deviation = float(abs(lookup_table_policy.call(sample_states) - numpy_policy.call(sample_states)).max())
+    config.logger.info(f'{model_path}: max deviation of table from network {max_deviation:.2e}')
+
+    return lookup_table_policy
+
+
+if __name__ == '__main__':
+
+    from src.config.config_gui import (
+        ConfigGUI,
+    )
+
+    # Build tables for the learned agents of the GUI
+    c = Config()
+    for agent_path in ConfigGUI.learned_agent_paths.values():
+        build_policy_table(config=c, model_path=Path(c.models_path, agent_path))
@@ -0,0 +1,204 @@
+
+from pathlib import Path
+from sys import path as sys_path
+
+project_root_path = Path(Path(__file__).parent, '..', '..')
+sys_path.append(str(project_root_path.resolve()))
+
+from argparse import (
+    ArgumentParser,
+)
+from time import (
+    perf_counter,
+)
+from numpy import (
+    ndarray,
+    argsort,
+    cumsum,
+    clip,
+    empty_like,
+    take_along_axis,
+    put_along_axis,
+    where,
+    sqrt,
+    zeros,
+    sum as np_sum,
+)
+
+from src.config.config import (
+    Config,
+)
+from src.data.scheduling_data import (
+    SchedulingData,
+)
+from src.models.policy_snapshot import (
+    load_policy_network,
+)
+from src.models.numpy_policy import (
+    NumpyPolicy,
+)
+
+# metric name -> reward component of SchedulingData.step_batched, or the weighted reward itself
+metric_keys: dict = {
+    'sum rate': 'sum rate',
+    'fairness': 'fairness score',
+    'priority missed': 'prio jobs missed',
+    'overall': 'reward',
+}
+
+
+def allocate_random(
+        states: ndarray,  # [batch, size_state]
+        config: Config,
+) -> ndarray:
+    """
+    Random shares, like the GUI's auto mode.
+    """
+
+    num_users = states.shape[1] // 3
+    shares = config.rng.random((len(states), num_users), dtype='float32')
+
+    return shares / np_sum(shares, axis=1, keepdims=True)
+
+
+def allocate_proportional_to_requests(
+        states: ndarray,  # [batch, size_state]
+        config: Config,
+) -> ndarray:
+
+    num_users = states.shape[1] // 3
+    requested_slots = states[:, num_users:2*num_users]
+    total_requested_slots = np_sum(requested_slots, axis=1, keepdims=True)
+    has_requests = total_requested_slots > 0
+
+    return where(has_requests, requested_slots / where(has_requests, total_requested_slots, 1), 0).astype('float32')
+
+
+def allocate_greedy(
+        states: ndarray,  # [batch, size_state]
+        config: Config,
+        priority_first: bool = False,  # serve priority jobs before all others
+) -> ndarray:
+    """
+    Grant users their full request in order of power gain, best channel first, until the slots run out.
+    """
+
+    num_users = states.shape[1] // 3
+    power_gains = states[:, 0:num_users]
+    requested_slots = states[:, num_users:2*num_users]
+    priorities = states[:, 2*num_users:3*num_users]
+
+    ranks = power_gains + priority_first * priorities * (power_gains.max() + 1)
+    order = argsort(-ranks, axis=1, kind='stable')
+    requested_slots_ordered = take_along_axis(requested_slots, order, axis=1)
+    slots_left = config.num_total_resource_slots - (cumsum(requested_slots_ordered, axis=1) - requested_slots_ordered)
+
+    granted_slots = empty_like(requested_slots)
+    put_along_axis(granted_slots, order, clip(slots_left, 0, requested_slots_ordered), axis=1)
+
+    return granted_slots / config.num_total_resource_slots
+
+
+baseline_allocators: dict = {
+    'random': allocate_random,
+    'proportional': allocate_proportional_to_requests,
+    'max channel': allocate_greedy,
+    'priority first': lambda states, config: allocate_greedy(states=states, config=config, priority_first=True),
+}
+
+
+def evaluate_policies(
+        config: Config,
+        policy_paths: dict,  # name -> policy snapshot, or SavedModel policy
+        num_scenarios: int = 1_000_000,
+        batch_size: int = 65_536,  # scenarios per inference call
+        include_baselines: bool = True,
+        confidence_z: float = 1.96,  # 95 % normal confidence intervals
+) -> dict:
+    """
+    Score saved policies and heuristic baselines on the same independently drawn scenarios. Each scenario is
+    one sim state, all allocators act on it once. Inference runs on batches of states via numpy copies of the
+    policies, rewards are computed batched via SchedulingData.step_batched.
+    Returns per allocator and metric the mean and the half width of its confidence interval.
+    """
+
+    allocators: dict = {}
+    for policy_name, policy_path in policy_paths.items():
+        network = load_policy_network(policy_path)
+        policy = NumpyPolicy.from_keras(network)
+        policy.verify(network=network, states=SchedulingData(config=config).sample_states(num_states=64))
+        allocators[policy_name] = policy.call
+    if include_baselines:
+        for baseline_name, allocate in baseline_allocators.items():
+            allocators[baseline_name] = lambda states, allocate=allocate: allocate(states=states, config=config)
+
+    sim = SchedulingData(config=config)
+    metric_sums = {name: zeros(len(metric_keys)) for name in allocators.keys()}
+    metric_square_sums = {name: zeros(len(metric_keys)) for name in allocators.keys()}
+    seconds_acting = {name: 0.0 for name in allocators.keys()}
+
+    time_start = perf_counter()
+    for batch_start in range(0, num_scenarios, batch_size):
+        states = sim.sample_states(num_states=min(batch_size, num_scenarios - batch_start))
+
+        for name, allocate in allocators.items():
+            time_start_acting = perf_counter()
+            actions = allocate(states)
+            seconds_acting[name] += perf_counter() - time_start_acting
+
+            rewards, reward_components = sim.step_batched(states=states, percentage_allocation_solutions=actions)
+            reward_components['reward'] = rewards
+            for metric_id, component_key in enumerate(metric_keys.values()):
+                values = reward_components[component_key].astype('float64')
+                metric_sums[name][metric_id] += np_sum(values)
+                metric_square_sums[name][metric_id] += np_sum(values ** 2)
+
+        print(f'\rScenarios: {(batch_start + len(states)) / num_scenarios:.0%}', end='')
+    print('\n')
+    config.logger.info(f'{num_scenarios} scenarios evaluated in {perf_counter() - time_start:.1f} s')
+
+    results = {}
+    for name in allocators.keys():
+        means = metric_sums[name] / num_scenarios
+        variances = metric_square_sums[name] / num_scenarios - means ** 2
+        confidence_half_widths = confidence_z * sqrt(clip(variances, 0, None) / num_scenarios)
+        results[name] = {
+            metric_name: (float(means[metric_id]), float(confidence_half_widths[metric_id]))
+            for metric_id, metric_name in enumerate(metric_keys.keys())
+        }
+
+    print(f'{"":<16}' + ''.join(f'{metric_name:>24}' for metric_name in metric_keys.keys()) + f'{"us / scenario":>16}')
+    for name, metrics in results.items():
+        print(f'{name:<16}'
+              + ''.join(f'{mean:>14.4f} ± {half_width:<7.4f}' for mean, half_width in metrics.values())
+              + f'{seconds_acting[name] / num_scenarios * 1e6:>16.2f}')
+
+    return results
+
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser(description='Batched offline evaluation of saved policies against heuristic baselines')
+    parser.add_argument('--policy', action='append', default=[], metavar='NAME=PATH',
+                        help='saved policy to evaluate, repeatable. Default: the learned agents of the GUI')
+    parser.add_argument('--num_scenarios', type=int, default=1_000_000)
+    parser.add_argument('--batch_size', type=int, default=65_536)
+    parser.add_argument('--no_baselines', action='store_true')
+    args = parser.parse_args()
+
+    c = Config()
+    if args.policy:
+        paths = {name: Path(path) for name, path in (policy.split('=', 1) for policy in args.policy)}
+    else:
+        from src.config.config_gui import (
+            ConfigGUI,
+        )
+        paths = {name: Path(c.models_path, path) for name, path in ConfigGUI.learned_agent_paths.items()}
+
+    evaluate_policies(
+        config=c,
+        policy_paths=paths,
+        num_scenarios=args.num_scenarios,
+        batch_size=args.batch_size,
+        include_baselines=not args.no_baselines,
+    )
@@ -468,7 +468,7 @@ class App(tk.Tk):
         for learner_name, learner in self.config_gui.learned_agents.items():
 
             # Get allocation action
-            action = learner.call(self.secondary_simulations[learner_name].get_state()[np.newaxis]).numpy().squeeze()
+            action = learner.get_action(self.secondary_simulations[learner_name].get_state())
 
             # Fill the small allocation resource grid with user allocation
             self.frame_allocations.resource_grids[self.config_gui.learned_agents_display_names_static[learner_name]].fill(
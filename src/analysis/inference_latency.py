@@ -0,0 +1,65 @@
+
+from pathlib import Path
+from sys import path as sys_path
+
+project_root_path = Path(Path(__file__).parent, '..', '..')
+sys_path.append(str(project_root_path.resolve()))
+
+from numpy import (
+    newaxis,
+)
+
+from src.config.config import (
+    Config,
+)
+from src.data.scheduling_data import (
+    SchedulingData,
+)
+from src.models.dqn import (
+    PolicyNetwork,
+)
+from src.models.policy_snapshot import (
+    load_policy_network,
+)
+from src.models.numpy_policy import (
+    NumpyPolicy,
+)
+from src.utils.measure_latency_us import (
+    measure_latency_us,
+)
+
+
+def compare_inference_latency(
+        model_path: Path | None = None,  # a saved policy, by default a fresh PolicyNetwork sized like the config
+        num_states: int = 1_000,
+) -> dict:
+    """
+    Compare per decision latency of the keras policy against its NumpyPolicy copy.
+    """
+
+    config = Config()
+    if model_path is None:
+        network = PolicyNetwork(num_actions=sum(config.num_users.values()),
+                                **config.network_args['policy_network_args'])
+        network.initialize_inputs(config.rng.random(config.size_state, dtype='float32')[newaxis])
+    else:
+        network = load_policy_network(model_path)
+    numpy_policy = NumpyPolicy.from_keras(network)
+
+    states = SchedulingData(config=config).sample_states(num_states=num_states)
+    max_deviation = numpy_policy.verify(network=network, states=states)
+
+    latencies_us = {
+        'keras call': measure_latency_us(lambda state: network.call(state[newaxis]).numpy().squeeze(), states),
+        'numpy': measure_latency_us(numpy_policy.get_action, states),
+    }
+    for name, latency_us in latencies_us.items():
+        print(f'{name}: {latency_us:.1f} us per decision')
+    print(f'numpy speedup: {latencies_us["keras call"] / latencies_us["numpy"]:.1f}, '
+          f'max deviation {max_deviation:.2e}')
+
+    return latencies_us
+
+
+if __name__ == '__main__':
+    compare_inference_latency()
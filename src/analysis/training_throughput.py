@@ -0,0 +1,143 @@
+
+from pathlib import Path
+from sys import path as sys_path
+
+project_root_path = Path(Path(__file__).parent, '..', '..')
+sys_path.append(str(project_root_path.resolve()))
+
+from time import (
+    perf_counter,
+)
+
+from src.config.config import (
+    Config,
+)
+from src.data.scheduling_data import (
+    SchedulingData,
+)
+from src.models.td3 import (
+    TD3ActorCritic,
+)
+from src.models.soft_actor_critic import (
+    SoftActorCritic,
+)
+
+
+def fill_experience_buffer(
+        allocator,
+        config: Config,
+        num_experiences: int,
+) -> None:
+    """
+    Fill an allocator's experience buffer with experiences from the scheduling sim under random allocations.
+    """
+
+    sim = SchedulingData(config=config)
+    num_actions = sum(config.num_users.values())
+
+    state_next = sim.get_state()
+    for _ in range(num_experiences):
+        state = state_next
+        action = config.rng.random(num_actions)
+        action = action / sum(action)
+        reward, _ = sim.step(percentage_allocation_solution=action)
+        state_next = sim.get_state()
+        allocator.add_experience(experience={'state': state, 'action': action, 'reward': reward,
+                                             'next_state': state_next})
+
+
+def measure_training_steps_per_second(
+        allocator,
+        num_warmup_steps: int,
+        num_steps: int,
+        num_updates_per_call: int = 1,
+) -> float:
+    """
+    Time allocator.train(), or allocator.train_many() for more than one update per call.
+    The warm-up steps absorb graph tracing.
+    """
+
+    def train() -> None:
+        if num_updates_per_call == 1:
+            allocator.train()
+        else:
+            allocator.train_many(num_updates=num_updates_per_call)
+
+    for _ in range(max(1, num_warmup_steps // num_updates_per_call)):
+        train()
+
+    num_calls = max(1, num_steps // num_updates_per_call)
+    time_start = perf_counter()
+    for _ in range(num_calls):
+        train()
+    seconds = perf_counter() - time_start
+
+    return num_calls * num_updates_per_call / seconds
+
+
+def compare_training_throughput(
+        num_warmup_steps: int = 20,
+        num_steps: int = 200,
+) -> dict:
+    """
+    Compare training steps per second of TD3ActorCritic and SoftActorCritic, each with and without
+    the XLA compiled train step, for the networks and batch size set in the config.
+    """
+
+    config = Config()
+    allocators = {
+        'td3': TD3ActorCritic(**{**config.td3_actor_critic_args, 'training_jit_compile': False}),
+        'td3_xla': TD3ActorCritic(**{**config.td3_actor_critic_args, 'training_jit_compile': True}),
+        'soft_actor_critic': SoftActorCritic(**{**config.soft_actor_critic_args, 'training_jit_compile': False}),
+        'soft_actor_critic_xla': SoftActorCritic(**{**config.soft_actor_critic_args, 'training_jit_compile': True}),
+    }
+
+    num_experiences = max(config.training_args['training_minimum_experiences'],
+                          config.training_args['training_batch_size'])
+    steps_per_second = {}
+    for allocator_name, allocator in allocators.items():
+        fill_experience_buffer(allocator=allocator, config=config, num_experiences=num_experiences)
+        steps_per_second[allocator_name] = measure_training_steps_per_second(allocator=allocator,
+                                                                            num_warmup_steps=num_warmup_steps,
+                                                                            num_steps=num_steps)
+        print(f'{allocator_name}: {steps_per_second[allocator_name]:.1f} training steps/s '
+              f'at batch size {config.training_args["training_batch_size"]}')
+
+    print(f'soft_actor_critic / td3: {steps_per_second["soft_actor_critic"] / steps_per_second["td3"]:.2f}')
+    print(f'td3 xla speedup: {steps_per_second["td3_xla"] / steps_per_second["td3"]:.2f}')
+    print(f'soft_actor_critic xla speedup: '
+          f'{steps_per_second["soft_actor_critic_xla"] / steps_per_second["soft_actor_critic"]:.2f}')
+
+    return steps_per_second
+
+
+def compare_update_loop_throughput(
+        num_updates_per_call: int = 8,
+        num_warmup_steps: int = 32,
+        num_steps: int = 400,
+) -> dict:
+    """
+    Compare training steps per second of TD3ActorCritic.train against train_many, which loops
+    num_updates_per_call updates inside one graph call.
+    """
+
+    config = Config()
+    allocator = TD3ActorCritic(**config.td3_actor_critic_args)
+    num_experiences = max(config.training_args['training_minimum_experiences'],
+                          num_updates_per_call * config.training_args['training_batch_size'])
+    fill_experience_buffer(allocator=allocator, config=config, num_experiences=num_experiences)
+
+    steps_per_second = {}
+    for updates_per_call in [1, num_updates_per_call]:
+        steps_per_second[updates_per_call] = measure_training_steps_per_second(allocator=allocator,
+                                                                              num_warmup_steps=num_warmup_steps,
+                                                                              num_steps=num_steps,
+                                                                              num_updates_per_call=updates_per_call)
+        print(f'td3, {updates_per_call} updates per call: {steps_per_second[updates_per_call]:.1f} training steps/s')
+
+    return steps_per_second
+
+
+if __name__ == '__main__':
+    compare_training_throughput()
+    compare_update_loop_throughput()
@@ -31,6 +31,7 @@ class Config:
         self._logging_level_stdio = logging.INFO  # DEBUG < INFO < WARNING < ERROR < CRITICAL
         self._logging_level_file = logging.WARNING
         self._logging_level_tensorflow = logging.INFO
+        self.seed: int | None = None  # seeds the rng, None draws fresh entropy
 
         # SCHEDULING SIM PARAMETERS-------------------------------------------------------------------------------------
         self.num_episodes: int = 60
@@ -57,18 +58,34 @@ class Config:
             'priority missed': -1,
             'fairness': 0.5,
         }
+        # Multi objective training: one allocator per objective, all trained from one shared experience stream
+        self.reward_weightings_per_objective = {
+            'max_sumrate': {'sum rate': 1.0, 'priority missed': 0.0, 'fairness': 0.0},
+            'fairness': {'sum rate': 0.0, 'priority missed': 0.0, 'fairness': 1.0},
+            'mixed': {'sum rate': 1/40, 'priority missed': -1, 'fairness': 0.5},
+        }
 
         # LEARNING PARAMETERS-------------------------------------------------------------------------------------------
+        self.allocator_type: str = 'td3'  # td3, soft_actor_critic
+        self.numpy_policy_sync_interval: int = 0  # act via numpy copies of td3 policies synced every n steps, 0: keras
+        self.checkpoint_interval_episodes: int = 1  # write a full training checkpoint for resuming, 0: never
+        self.snapshot_export_saved_model: bool = True  # export the best policy snapshots as SavedModel after training
+        self.reward_conditioned_evaluation_num_states: int = 10_000  # fixed states that score reward conditioned runs
         self.exploration_noise_decay_start_percent: float = 0.0  # when to start decay in %
         self.exploration_noise_decay_threshold_percent: float = 0.8  # when to decay to 0 in %
         self.exploration_noise_momentum_initial: float = 1.0
 
         self.experience_buffer_args: dict = {
-            'buffer_size': 10_000,  # Num of samples held, FIFO
+            'buffer_size': 10_000,  # Num of samples held
             'priority_scale_alpha': 0.0,  # alpha in [0, 1], alpha=0 uniform sampling, 1 is fully prioritized sampling
-            'importance_sampling_correction_beta': 1.0  # beta in [0%, 100%], beta=100% is full correction
+            'importance_sampling_correction_beta': 1.0,  # beta in [0%, 100%], beta=100% is full correction
+            'compact_storage': False,  # store states as uint8 codes, actions as float16, decoded on sampling
+            'sequential_storage': False,  # store observations once, next_state of step t is the state of t+1
+            'state_interning': False,  # store each unique state once, experiences reference it by id
+            'eviction_policy': 'fifo',  # fifo, reservoir, lowest_priority, age_stratified
         }
         self.network_args: dict = {
+            'num_value_networks': 2,  # Clipped double Q uses the min over an ensemble of value networks
             'value_network_args': {
                 'hidden_layer_units': [512, 512, 512],
                 'activation_hidden': 'tanh',  # >relu, tanh
@@ -99,6 +116,53 @@ class Config:
             'training_batch_size': 256,  # Num of experiences sampled in one training step
             'training_target_update_momentum_tau': 1e-2,  # How much of the primary network copy to target networks
             'future_reward_discount_gamma': 0.0,  # Exponential future reward discount for stability
+            'training_prefetch_batches': 0,  # Num of batches prepared in the background, 0 samples synchronously
+            'training_jit_compile': False,  # Compile the whole train step with XLA, fewer kernel launches
+            'training_update_to_data_ratio': 1.0,  # Gradient updates per collected experience
+            'training_updates_per_call': 1,  # Gradient updates looped inside one graph call
+        }
+        self.distillation_args: dict = {
+            'num_states': 50_000,  # Num of sim states labeled by the teacher policy
+            'exploration_noise_momentum': 0.5,  # Mix teacher actions with random ones to widen the state coverage
+            'student_hidden_layer_units': [64, 64],
+            'student_optimizer': tf.keras.optimizers.Adam,
+            'student_optimizer_args': {
+                'learning_rate': 1e-3,
+            },
+            'training_batch_size': 256,
+            'num_epochs': 30,
+            'num_evaluation_steps': 2_000,  # Sim steps on which student and teacher rewards are compared
+        }
+        self.quantization_args: dict = {
+            'num_calibration_states': 1_000,  # Num of sim states that calibrate the int8 activation ranges
+            'exploration_noise_momentum': 0.5,  # Mix policy actions with random ones to widen the state coverage
+            'num_evaluation_steps': 2_000,  # Sim steps on which quantized and float rewards are compared
+        }
+        self.actor_learner_args: dict = {
+            'num_actors': 4,  # Sim processes acting in parallel while the learner trains
+            'num_steps_per_message': 50,  # Experiences an actor collects before sending them to the learner
+            'policy_sync_interval_updates': 100,  # Learner updates between publishing policy weights to the actors
+            'experience_queue_size': 64,  # Messages held between actors and learner, a full queue blocks the actors
+            'exploration_noise_base': 0.4,  # Actor i uses noise momentum base ** (1 + alpha * i / (num_actors - 1))
+            'exploration_noise_alpha': 7,
+        }
+        self.sweep_args: dict = {
+            'num_trials': 27,
+            'num_workers': 4,  # Trials trained in parallel, one process each
+            'reduction_factor_eta': 3,  # Successive halving keeps the best 1 / eta of the trials at each rung
+            'min_episodes_per_trial': 2,  # First rung, later rungs after min_episodes_per_trial * eta ** k episodes
+            'search_space': {  # Config attribute -> candidate values, nested dicts override nested entries
+                'training_args': {
+                    'training_batch_size': [64, 128, 256, 512],
+                },
+                'exploration_noise_decay_threshold_percent': [0.4, 0.6, 0.8],
+                'network_args': {
+                    'value_network_optimizer_args': {'learning_rate': [1e-5, 3e-5, 1e-4, 3e-4]},
+                    'policy_network_optimizer_args': {'learning_rate': [1e-7, 1e-6, 1e-5]},
+                    'value_network_args': {'hidden_layer_units': [[256, 256], [512, 512, 512]]},
+                    'policy_network_args': {'hidden_layer_units': [[256, 256], [512, 512, 512]]},
+                },
+            },
         }
         self.training_args_soft_actor_critic: dict = {
             'entropy_scale_alpha_initial': 1.0,  # Weights the 'soft' entropy penalty against the td error
@@ -120,7 +184,7 @@ class Config:
         self.models_path = Path(self.project_root_path, 'models')
 
         # rng
-        self.rng = default_rng(seed=None)
+        self.rng = default_rng(seed=self.seed)
 
         # Logging
         #   get new sub loggers via logger.getChild(__name__) to improve messaging
@@ -190,7 +254,13 @@ class Config:
         logging_file_handler.setFormatter(logging_formatter)
         logging_stdio_handler.setFormatter(logging_formatter)
 
-        # Add Handlers
+        # Add Handlers, replacing those of an earlier setup so that repeated _post_init calls do not duplicate lines
+        logging_file_handler.set_name('config_file')
+        logging_stdio_handler.set_name('config_stdio')
+        for handler in list(self.logger.handlers):
+            if handler.get_name() in ('config_file', 'config_stdio'):
+                self.logger.removeHandler(handler)
+                handler.close()
         self.logger.addHandler(logging_file_handler)
         self.logger.addHandler(logging_stdio_handler)
 
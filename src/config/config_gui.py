@@ -11,13 +11,30 @@ from pathlib import (
 import yaml
 
 from matplotlib.colors import LinearSegmentedColormap
-from keras.models import (
-    load_model,
+from numpy.random import (
+    default_rng,
+)
+
+from src.models.policy_snapshot import (
+    load_policy_network,
+)
+from src.models.numpy_policy import (
+    NumpyPolicy,
+)
+from src.models.lookup_table_policy import (
+    LookupTablePolicy,
 )
 
 
 class ConfigGUI:
 
+    # relative to the models folder. A class attribute, so that scripts read it without loading the policies
+    learned_agent_paths: dict = {
+        'sumrate': Path('max_sumrate', 'policy'),
+        'fairness': Path('fairness', 'policy_snap_0.914'),
+        'mixed': Path('mixed', 'policy_snap_1.020'),
+    }
+
     def __init__(
             self,
     ) -> None:
@@ -98,11 +115,23 @@ class ConfigGUI:
 
         self.countdown_reset_value_seconds: int = 10
 
-        self.learned_agents: dict = {
-            'sumrate': load_model(Path(self.models_path, 'max_sumrate', 'policy')),
-            'fairness': load_model(Path(self.models_path, 'fairness', 'policy_snap_0.914')),
-            'mixed': load_model(Path(self.models_path, 'mixed', 'policy_snap_1.020')),
-        }
+        # The GUI acts with lookup tables of the learned policies where built, see build_policy_tables.py.
+        #  Otherwise, it acts with numpy copies of the policies, verified against keras on states
+        #  spanning the range of power gains and job sizes
+        verification_rng = default_rng(seed=0)
+        self.learned_agents: dict = {}
+        for agent_name, agent_path in self.learned_agent_paths.items():
+            agent_path = Path(self.models_path, agent_path)
+            table_path = Path(agent_path, 'policy_table.npy')
+            if table_path.is_file():
+                self.learned_agents[agent_name] = LookupTablePolicy.load(table_path=table_path)
+                continue
+            network = load_policy_network(agent_path)
+            self.learned_agents[agent_name] = NumpyPolicy.from_keras(network)
+            self.learned_agents[agent_name].verify(
+                network=network,
+                states=verification_rng.uniform(0, 16, size=(32, self.learned_agents[agent_name].size_input)),
+            )
 
         self._post_init()
 
@@ -1,13 +1,19 @@
 
 from numpy import (
     ndarray,
+    array,
     zeros,
+    arange,
     multiply,
     round as np_round,
     minimum,
     log2,
     mean,
     std,
+    where,
+    argmax,
+    sum as np_sum,
+    any as np_any,
 )
 from copy import (
     deepcopy,
@@ -19,6 +25,14 @@ from src.data.resource_grid import (
 
 
 class SchedulingData:
+
+    # reward weighting name -> name of the matching unweighted component returned by step
+    reward_component_keys: dict = {
+        'sum rate': 'sum rate',
+        'priority missed': 'prio jobs missed',
+        'fairness': 'fairness score',
+    }
+
     def __init__(
             self,
             config,
@@ -101,6 +115,125 @@ class SchedulingData:
 
         return state.astype('float32')
 
+    def get_reward_components_vector(
+            self,
+            reward_components: dict,
+    ) -> ndarray:
+        """
+        Collect the unweighted reward components from step into a vector ordered like reward_component_keys,
+        so that the reward for any weighting is the dot product with get_reward_weightings_vector.
+        """
+
+        return array([reward_components[component_key] for component_key in self.reward_component_keys.values()],
+                     dtype='float32')
+
+    def get_reward_weightings_vector(
+            self,
+            reward_weightings: dict,
+    ) -> ndarray:
+
+        return array([reward_weightings[weighting_key] for weighting_key in self.reward_component_keys.keys()],
+                     dtype='float32')
+
+    def sample_states(
+            self,
+            num_states: int,
+    ) -> ndarray:
+        """
+        Draw independent states, distributed like the states get_state returns after each step.
+        Power gains and jobs are drawn like update_user_power_gain and generate_new_jobs draw them,
+        vectorized over the states. The sim itself is unchanged.
+        """
+
+        users = list(self.users.values())
+        num_users = len(users)
+
+        states = zeros((num_states, 3 * num_users), dtype='float32')
+        states[:, 0:num_users] = self.rng.integers(low=1, high=5, size=(num_states, num_users)) ** 2
+        has_job = self.rng.random((num_states, num_users)) < array([user.prob_new_job for user in users])
+        job_sizes = self.rng.integers(low=1, high=array([user.max_job_size_resource_slots for user in users]) + 1,
+                                      size=(num_states, num_users))
+        states[:, num_users:2*num_users] = where(has_job, job_sizes, 0)
+        states[:, 2*num_users:3*num_users] = has_job & array([user.job_prio for user in users])
+
+        return states
+
+    def step_batched(
+            self,
+            states: ndarray,  # [batch, size_state], e.g., from sample_states
+            percentage_allocation_solutions: ndarray,  # [batch, num_users]
+    ) -> tuple[ndarray, dict]:
+        """
+        Rewards and reward components of allocations, scored like step scores them, vectorized over a batch
+        of states. Unlike step, the sim does not move on.
+        """
+
+        num_users = len(self.users)
+        total_resource_slots = self.resource_grid.total_resource_slots
+        row_ids = arange(len(states))
+
+        power_gains = states[:, 0:num_users]
+        requested_slots_per_ue = states[:, num_users:2*num_users]
+        priorities = states[:, 2*num_users:3*num_users]
+
+        # Convert percentage allocation into slot allocation, but at most as many res as requested
+        slot_allocation_solutions = minimum(np_round(percentage_allocation_solutions * total_resource_slots),
+                                            requested_slots_per_ue, dtype='float32')
+
+        # grant at most one additional resource if there was rounding down, to the first user that can take it
+        remainders = np_round(percentage_allocation_solutions * total_resource_slots - slot_allocation_solutions,
+                              decimals=5)
+        can_take_more = (remainders > 0) & (requested_slots_per_ue > slot_allocation_solutions)
+        rounded_down = ((np_sum(slot_allocation_solutions, axis=1) == total_resource_slots - 1)
+                        & np_any(can_take_more, axis=1))
+        slot_allocation_solutions[row_ids[rounded_down], argmax(can_take_more[rounded_down], axis=1)] += 1
+
+        # remove resources distributed beyond the available ones, each from a random user that has some
+        while True:
+            too_many = np_sum(slot_allocation_solutions, axis=1) > total_resource_slots
+            if not np_any(too_many):
+                break
+            random_user_ids = argmax(self.rng.random((int(np_sum(too_many)), num_users))
+                                     * (slot_allocation_solutions[too_many] > 0), axis=1)
+            slot_allocation_solutions[row_ids[too_many], random_user_ids] -= 1
+
+        sum_rate_capacity_bit_per_second = np_sum(
+            slot_allocation_solutions * log2(1 + power_gains * self.config.snr_ue_linear), axis=1)
+
+        priority_jobs_missed_counter = np_sum((priorities == 1) & (slot_allocation_solutions < requested_slots_per_ue),
+                                              axis=1)
+
+        # jain's fairness score, middle out jobs that requested little, in user order like step
+        weighted_slots_per_ue = multiply(slot_allocation_solutions, power_gains, dtype='float64')
+        for ue_id in range(num_users):
+            weighted_slots_per_ue[:, ue_id] = where(
+                requested_slots_per_ue[:, ue_id] <= slot_allocation_solutions[:, ue_id],
+                mean(weighted_slots_per_ue, axis=1),
+                weighted_slots_per_ue[:, ue_id],
+            )
+        weighted_slots_mean = mean(weighted_slots_per_ue, axis=1)
+        has_weighted_slots = np_sum(weighted_slots_per_ue, axis=1) > 0
+        fairness_scores = where(
+            has_weighted_slots,
+            1 / (1 + (std(weighted_slots_per_ue, axis=1) / where(has_weighted_slots, weighted_slots_mean, 1))**2),
+            where(np_sum(requested_slots_per_ue, axis=1) == 0, 1.0, 0.0),
+        ).astype('float32')
+        fairness_scores = (fairness_scores - 1/num_users) / (1 - 1/num_users)
+
+        rewards = (
+            + self.config.reward_weightings['sum rate'] * sum_rate_capacity_bit_per_second
+            + self.config.reward_weightings['priority missed'] * priority_jobs_missed_counter
+            + self.config.reward_weightings['fairness'] * fairness_scores
+        ).astype('float32')
+
+        reward_components = {
+            'sum rate': sum_rate_capacity_bit_per_second,
+            'prio jobs missed': priority_jobs_missed_counter,
+            'fairness score': fairness_scores,
+        }
+
+        return rewards, reward_components
+
     def step(
             self,
             percentage_allocation_solution: ndarray,
@@ -0,0 +1,430 @@
+
+from numpy import (
+    ndarray,
+)
+from numpy.random import (
+    default_rng,
+    Generator,
+)
+from tensorflow import (
+    function as tf_function,
+    constant as tf_constant,
+    float32 as tf_float32,
+    TensorSpec as tf_TensorSpec,
+    range as tf_range,
+    shape as tf_shape,
+    stack as tf_stack,
+)
+from abc import (
+    ABC,
+    abstractmethod,
+)
+from logging import (
+    Logger,
+)
+from pathlib import (
+    Path,
+)
+from time import (
+    perf_counter,
+)
+
+from src.models.experience_buffer import (
+    ExperienceBuffer,
+)
+from src.models.batch_prefetcher import (
+    BatchPrefetcher,
+)
+from src.models.policy_snapshot import (
+    load_policy_weights,
+)
+
+
+class ActorCriticBase(ABC):
+    """
+    Experience handling and training loop shared by the actor critic allocators. Subclasses create the
+    networks, implement train_step, one gradient update on a batch of (states, actions, rewards,
+    next_states, sample_importance_weights), and call build_train_graphs once their networks exist.
+    """
+
+    def __init__(
+            self,
+            rng: default_rng,
+            parent_logger: Logger,
+            future_reward_discount_gamma: float,
+            training_minimum_experiences: int,
+            training_batch_size: int,
+            training_target_update_momentum_tau: float,
+            training_prefetch_batches: int,
+            training_update_to_data_ratio: float,
+            training_updates_per_call: int,
+            experience_buffer_args: dict,
+            experience_buffer: ExperienceBuffer | None,  # share an existing buffer instead
+            reward_weightings: ndarray | None,  # train on rewards relabeled from reward components
+    ) -> None:
+
+        self.rng: default_rng = rng
+        self.logger: Logger = parent_logger.getChild(type(self).__module__)
+
+        self.training_minimum_experiences: int = training_minimum_experiences
+        self.training_batch_size: int = training_batch_size
+        self.future_reward_discount_gamma: float = future_reward_discount_gamma
+        self.training_target_update_momentum_tau: float = training_target_update_momentum_tau
+        self.training_update_to_data_ratio: float = training_update_to_data_ratio
+        self.training_updates_per_call: int = training_updates_per_call
+        self.training_update_credit: float = 0.0  # gradient updates owed to the experiences collected so far
+
+        if experience_buffer is None:
+            experience_buffer = ExperienceBuffer(**experience_buffer_args)
+        self.experience_buffer: ExperienceBuffer = experience_buffer
+        self.reward_weightings = reward_weightings
+        if self.training_updates_per_call * self.training_batch_size > self.experience_buffer.buffer_size:
+            raise ValueError(f'{self.training_updates_per_call} updates per call of batch size '
+                             f'{self.training_batch_size} need more experiences than the buffer holds, '
+                             f'{self.experience_buffer.buffer_size}')
+
+        # Prefetching prepares upcoming batches on a background thread while the current gradient step runs
+        self.batch_prefetcher = None
+        if training_prefetch_batches > 0:
+            # the worker samples with its own rng, drawing from the shared one would make seeded runs depend
+            #  on thread timing
+            self.batch_prefetcher = BatchPrefetcher(prepare_batch=self.prepare_batch,
+                                                    num_prefetch_batches=training_prefetch_batches,
+                                                    rng=default_rng(seed=self.rng.integers(2 ** 63)),
+                                                    parent_logger=self.logger)
+        self.batch_stall_seconds: float = 0.0  # time the training thread waited for batches
+        self.batch_stall_count: int = 0
+
+    def build_train_graphs(
+            self,
+            size_state: int,  # as seen by the networks
+            num_actions: int,
+            jit_compile: bool,
+    ) -> None:
+
+        # Fixed input signatures trace the train step once. With jit_compile, XLA fuses the whole step,
+        #  including the target update, instead of launching many small kernels
+        self.train_graph = tf_function(
+            self.train_step,
+            input_signature=[
+                tf_TensorSpec(shape=[self.training_batch_size, size_state], dtype=tf_float32),  # states
+                tf_TensorSpec(shape=[self.training_batch_size, num_actions], dtype=tf_float32),  # actions
+                tf_TensorSpec(shape=[self.training_batch_size], dtype=tf_float32),  # rewards
+                tf_TensorSpec(shape=[self.training_batch_size, size_state], dtype=tf_float32),  # next_states
+                tf_TensorSpec(shape=[self.training_batch_size], dtype=tf_float32),  # sample_importance_weights
+            ],
+            jit_compile=jit_compile,
+        )
+        # train_many runs several updates in one graph call, its batches are stacked along a leading update axis
+        self.train_many_graph = tf_function(
+            self.train_steps,
+            input_signature=[
+                tf_TensorSpec(shape=[None, self.training_batch_size, size_state], dtype=tf_float32),
+                tf_TensorSpec(shape=[None, self.training_batch_size, num_actions], dtype=tf_float32),
+                tf_TensorSpec(shape=[None, self.training_batch_size], dtype=tf_float32),
+                tf_TensorSpec(shape=[None, self.training_batch_size, size_state], dtype=tf_float32),
+                tf_TensorSpec(shape=[None, self.training_batch_size], dtype=tf_float32),
+            ],
+            jit_compile=jit_compile,
+        )
+
+    @abstractmethod
+    def train_step(
+            self,
+            states,
+            actions,
+            rewards,
+            next_states,
+            sample_importance_weights,
+    ):
+        pass
+
+    def get_training_state(
+            self,
+    ) -> dict:
+        """
+        Host copy of everything training continues from: the weights of all networks,
+        the optimizer slots of the primary networks, and the update credit.
+        """
+
+        arrays = {}
+        for network_type, network_list in self.networks.items():
+            for network_pair_id, network_pair in enumerate(network_list):
+                for network_rank, network in network_pair.items():
+                    arrays[f'{network_type}_{network_pair_id}_{network_rank}'] = network.get_weights()
+                arrays[f'{network_type}_{network_pair_id}_optimizer'] = [
+                    variable.numpy() for variable in network_pair['primary'].optimizer.variables]
+
+        return {
+            'arrays': arrays,  # name -> list of arrays
+            'training_update_credit': self.training_update_credit,
+        }
+
+    def set_training_state(
+            self,
+            training_state: dict,  # from get_training_state
+    ) -> None:
+
+        arrays = training_state['arrays']
+        for network_type, network_list in self.networks.items():
+            for network_pair_id, network_pair in enumerate(network_list):
+                for network_rank, network in network_pair.items():
+                    network.set_weights(arrays[f'{network_type}_{network_pair_id}_{network_rank}'])
+                # optimizers create their slots on the first update, build them to have something to restore into
+                optimizer = network_pair['primary'].optimizer
+                optimizer.build(network_pair['primary'].trainable_variables)
+                for variable, value in zip(optimizer.variables, arrays[f'{network_type}_{network_pair_id}_optimizer']):
+                    variable.assign(value)
+
+        self.training_update_credit = training_state['training_update_credit']
+
+    def load_policy(
+            self,
+            policy_path: Path,  # policy snapshot, or SavedModel policy
+    ) -> None:
+        """
+        Restore saved policy weights into the existing policy networks, e.g., to evaluate or to fine-tune
+        a trained policy. The networks stay the same objects, so the traced graphs that use them stay valid.
+        Raises ValueError if the saved policy has a different layout.
+        """
+
+        weights = load_policy_weights(policy_path)
+        for network_pair in self.networks['policy']:
+            for network in network_pair.values():
+                network.set_weights(weights)
+        self.logger.info(f'Loaded policy from {policy_path}')
+
+    def add_experience(
+            self,
+            experience: dict,
+    ) -> None:
+        self.experience_buffer.add_experience(experience=experience)
+
+    def add_experiences(
+            self,
+            experiences: dict,
+    ) -> None:
+        self.experience_buffer.add_experiences(experiences=experiences)
+
+    def train_steps(
+            self,
+            states,
+            actions,
+            rewards,
+            next_states,
+            sample_importance_weights,
+    ):
+        """
+        One train_step per batch along the leading update axis, looped inside the graph.
+        """
+
+        for update_id in tf_range(tf_shape(states)[0]):
+            self.train_step(
+                states=states[update_id],
+                actions=actions[update_id],
+                rewards=rewards[update_id],
+                next_states=next_states[update_id],
+                sample_importance_weights=sample_importance_weights[update_id],
+            )
+
+    def sample_experiences(
+            self,
+            num_experiences: int,
+            rng: Generator | None = None,  # by default the allocator's rng
+    ) -> tuple[dict, ndarray]:
+        """
+        Sample experiences and their importance weights from the experience buffer, rewards relabeled
+        with reward_weightings where given.
+        """
+
+        (
+            sample_experiences,
+            sample_experience_ids,
+            sample_importance_weights,
+        ) = self.experience_buffer.sample(batch_size=num_experiences,
+                                          reward_weightings=self.reward_weightings,
+                                          rng=rng)
+
+        return sample_experiences, sample_importance_weights
+
+    def prepare_batch(
+            self,
+            rng: Generator | None = None,  # by default the allocator's rng
+    ) -> tuple:
+        """
+        Sample a batch from the experience buffer and convert it to float32 tensors.
+        """
+
+        sample_experiences, sample_importance_weights = self.sample_experiences(
+            num_experiences=self.training_batch_size, rng=rng)
+
+        states = tf_constant(sample_experiences['state'], dtype=tf_float32)
+        actions = tf_constant(sample_experiences['action'], dtype=tf_float32)
+        rewards = tf_constant(sample_experiences['reward'], dtype=tf_float32)
+        next_states = tf_constant(sample_experiences['next_state'], dtype=tf_float32)
+        sample_importance_weights = tf_constant(sample_importance_weights, dtype=tf_float32)
+
+        return (
+            states,
+            actions,
+            rewards,
+            next_states,
+            sample_importance_weights,
+        )
+
+    def get_batch_stall_report(
+            self,
+    ) -> str:
+        """
+        Summarize how long the training thread waited for batches. With prefetching, the time the
+        background worker spent preparing batches is work that no longer stalls the training thread.
+        """
+
+        if self.batch_stall_count == 0:
+            return 'no training batches yet'
+
+        stall_ms = 1_000 * self.batch_stall_seconds / self.batch_stall_count
+        report = f'batch stall {stall_ms:.3f} ms/step'
+        if self.batch_prefetcher is not None and self.batch_prefetcher.num_batches_prepared > 0:
+            preparation_ms = (
+                1_000 * self.batch_prefetcher.seconds_preparing / self.batch_prefetcher.num_batches_prepared
+            )
+            report += (f', batch preparation {preparation_ms:.3f} ms/step in background'
+                       f', stall removed {preparation_ms - stall_ms:.3f} ms/step')
+
+        return report
+
+    def stop_batch_prefetcher(
+            self,
+    ) -> None:
+        """
+        End the background batch preparation, e.g., when training ends.
+        """
+
+        if self.batch_prefetcher is not None:
+            self.batch_prefetcher.stop()
+
+    def train(
+            self,
+    ) -> None:
+
+        if (self.experience_buffer.get_len() < self.training_minimum_experiences) or (
+                self.experience_buffer.get_len() < self.training_batch_size):
+            return
+
+        # SAMPLE FROM BUFFER
+        time_start = perf_counter()
+        if self.batch_prefetcher is not None:
+            batch = self.batch_prefetcher.get_batch()
+        else:
+            batch = self.prepare_batch()
+        self.batch_stall_seconds += perf_counter() - time_start
+        self.batch_stall_count += 1
+
+        (
+            states,
+            actions,
+            rewards,
+            next_states,
+            sample_importance_weights,
+        ) = batch
+
+        self.train_graph(
+            states=states,
+            actions=actions,
+            rewards=rewards,
+            next_states=next_states,
+            sample_importance_weights=sample_importance_weights,
+        )
+
+    def prepare_batches(
+            self,
+            num_batches: int,
+    ) -> tuple:
+        """
+        Sample num_batches batches from the experience buffer in one draw, stacked along a leading update axis.
+        The batches are drawn jointly without replacement, so they do not overlap.
+        """
+
+        sample_experiences, sample_importance_weights = self.sample_experiences(
+            num_experiences=num_batches * self.training_batch_size)
+
+        def stack(values: ndarray) -> ndarray:
+            return values.reshape(num_batches, self.training_batch_size, *values.shape[1:])
+
+        # importance weights are normalized per batch, as if each batch was sampled on its own
+        sample_importance_weights = stack(sample_importance_weights)
+        sample_importance_weights = sample_importance_weights / sample_importance_weights.max(axis=1, keepdims=True)
+
+        states = tf_constant(stack(sample_experiences['state']), dtype=tf_float32)
+        actions = tf_constant(stack(sample_experiences['action']), dtype=tf_float32)
+        rewards = tf_constant(stack(sample_experiences['reward']), dtype=tf_float32)
+        next_states = tf_constant(stack(sample_experiences['next_state']), dtype=tf_float32)
+        sample_importance_weights = tf_constant(sample_importance_weights, dtype=tf_float32)
+
+        return (
+            states,
+            actions,
+            rewards,
+            next_states,
+            sample_importance_weights,
+        )
+
+    def train_many(
+            self,
+            num_updates: int,
+    ) -> bool:
+        """
+        Run num_updates gradient updates in a single graph call. Returns whether it trained,
+        the buffer has to hold num_updates batches.
+        """
+
+        if (self.experience_buffer.get_len() < self.training_minimum_experiences) or (
+                self.experience_buffer.get_len() < num_updates * self.training_batch_size):
+            return False
+
+        # SAMPLE FROM BUFFER
+        time_start = perf_counter()
+        if self.batch_prefetcher is not None:
+            batch = tuple(tf_stack(tensors) for tensors in zip(*[self.batch_prefetcher.get_batch()
+                                                                  for _ in range(num_updates)]))
+        else:
+            batch = self.prepare_batches(num_batches=num_updates)
+        self.batch_stall_seconds += perf_counter() - time_start
+        self.batch_stall_count += num_updates
+
+        (
+            states,
+            actions,
+            rewards,
+            next_states,
+            sample_importance_weights,
+        ) = batch
+
+        self.train_many_graph(
+            states=states,
+            actions=actions,
+            rewards=rewards,
+            next_states=next_states,
+            sample_importance_weights=sample_importance_weights,
+        )
+
+        return True
+
+    def train_scheduled(
+            self,
+    ) -> None:
+        """
+        Call once per collected experience. Accrues training_update_to_data_ratio gradient updates once
+        the buffer holds training_minimum_experiences, and runs them via train_many in chunks of
+        training_updates_per_call. Updates owed while the buffer is too small for a chunk are kept.
+        """
+
+        if self.experience_buffer.get_len() < self.training_minimum_experiences:
+            return
+
+        self.training_update_credit += self.training_update_to_data_ratio
+        while self.training_update_credit >= self.training_updates_per_call:
+            if not self.train_many(num_updates=self.training_updates_per_call):
+                break
+            self.training_update_credit -= self.training_updates_per_call
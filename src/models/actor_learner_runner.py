@@ -0,0 +1,297 @@
+
+from numpy import (
+    array,
+    concatenate,
+    mean,
+    max as np_max,
+    sum as np_sum,
+)
+from numpy.random import (
+    default_rng,
+)
+from multiprocessing import (
+    get_context,
+)
+from queue import (
+    Empty,
+    Full,
+)
+from math import (
+    ceil,
+)
+from pathlib import (
+    Path,
+)
+from shutil import (
+    copytree,
+)
+from time import (
+    perf_counter,
+)
+
+from src.config.config import (
+    Config,
+)
+from src.data.scheduling_data import (
+    SchedulingData,
+)
+from src.models.td3 import (
+    TD3ActorCritic,
+)
+from src.models.numpy_policy import (
+    NumpyPolicy,
+)
+from src.models.training_runner import (
+    add_random_distribution,
+)
+
+
+class Actor:
+    """
+    Acting side of actor learner training, runs in its own process. Steps a private sim with a numpy copy of
+    the policy and sends its experiences to the learner in messages of num_steps_per_message experiences.
+    """
+
+    def __init__(
+            self,
+            config: Config,
+            seed: int,
+    ) -> None:
+
+        # the config arrives pickled, reseed so that actors do not replay the same random stream
+        config.rng = default_rng(seed=seed)
+        self.config = config
+        self.rng = self.config.rng
+
+    def act(
+            self,
+            actor_id: int,
+            policy_args: dict,  # kernels, biases, activation_names of the initial NumpyPolicy
+            exploration_noise_momentum: float,
+            num_steps: int,
+            num_steps_per_message: int,
+            experience_queue,  # multiprocessing Queue to the learner
+            weights_queue,  # multiprocessing Queue, holds the latest (policy_version, kernels, biases)
+            stop_event,  # multiprocessing Event, set by the learner to end acting early
+    ) -> None:
+
+        sim = SchedulingData(config=self.config)
+        policy = NumpyPolicy(**policy_args)
+        policy_version = 0
+
+        experiences: dict = {'state': [], 'action': [], 'reward': [], 'next_state': []}
+        state_next = sim.get_state()
+        for step_id in range(num_steps):
+            state = state_next
+            action = add_random_distribution(rng=self.rng,
+                                             action=policy.get_action(state),
+                                             tau_momentum=exploration_noise_momentum)
+            reward, _ = sim.step(percentage_allocation_solution=action)
+            state_next = sim.get_state()
+
+            for key, value in zip(['state', 'action', 'reward', 'next_state'], [state, action, reward, state_next]):
+                experiences[key].append(value)
+
+            if len(experiences['state']) == num_steps_per_message or step_id == num_steps - 1:
+                experience_queue.put({
+                    'actor_id': actor_id,
+                    'policy_version': policy_version,  # version of the policy that collected the experiences
+                    'experiences': {key: array(values, dtype='float32') for key, values in experiences.items()},
+                    'finished': step_id == num_steps - 1,
+                })
+                experiences = {key: [] for key in experiences.keys()}
+
+                try:
+                    policy_version, kernels, biases = weights_queue.get_nowait()
+                    policy.set_weights(kernels=kernels, biases=biases)
+                except Empty:
+                    pass
+
+                if stop_event.is_set():
+                    return
+
+
+def run_actor(
+        config: Config,
+        seed: int,
+        **act_args,
+) -> None:
+    """
+    Entry point of an actor process.
+    """
+
+    Actor(config=config, seed=seed).act(**act_args)
+
+
+class ActorLearnerRunner:
+    """
+    Ape-X style training on one machine. num_actors processes step their own sims with periodically refreshed
+    numpy copies of the policy, each with its own fixed exploration noise. The learner collects their
+    experiences from a queue and trains the td3 allocator continuously, instead of alternating acting and
+    training in one loop.
+    """
+
+    def __init__(
+            self,
+            config: Config | None = None,  # by default a fresh Config
+    ) -> None:
+
+        self.config = config if config is not None else Config()
+        self.rng = self.config.rng
+
+    def get_exploration_noise_momenta(
+            self,
+            num_actors: int,
+    ) -> list:
+        """
+        Ape-X spreads exploration over the actors, from noise base for actor 0 to base ** (1 + alpha).
+        """
+
+        actor_learner_args = self.config.actor_learner_args
+        base = actor_learner_args['exploration_noise_base']
+        alpha = actor_learner_args['exploration_noise_alpha']
+
+        return [base ** (1 + alpha * actor_id / max(num_actors - 1, 1)) for actor_id in range(num_actors)]
+
+    def train_distributed(
+            self,
+            training_name: str,
+    ) -> dict:
+        """
+        Run config.steps_total sim steps, split over the actors, and train on them as they arrive.
+        Returns throughput and policy staleness, the learner updates between publishing a policy and
+        the learner receiving the experiences collected with it.
+        """
+
+        actor_learner_args = self.config.actor_learner_args
+        num_actors = actor_learner_args['num_actors']
+
+        allocator = TD3ActorCritic(**self.config.td3_actor_critic_args)
+        policy_network = allocator.networks['policy'][0]['primary']
+        policy = NumpyPolicy.from_keras(policy_network)
+        updates_per_call = allocator.training_updates_per_call
+        minimum_experiences = max(allocator.training_minimum_experiences,
+                                  updates_per_call * allocator.training_batch_size)
+
+        # spawn instead of fork, forking a process that already runs tensorflow threads is unsafe
+        context = get_context('spawn')
+        experience_queue = context.Queue(maxsize=actor_learner_args['experience_queue_size'])
+        weights_queues = [context.Queue(maxsize=1) for _ in range(num_actors)]
+        stop_event = context.Event()
+
+        num_steps_per_actor = ceil(self.config.steps_total / num_actors)
+        actors = [
+            context.Process(
+                target=run_actor,
+                kwargs={
+                    'config': self.config,
+                    'seed': int(self.rng.integers(2**63)),
+                    'actor_id': actor_id,
+                    'policy_args': {'kernels': policy.kernels, 'biases': policy.biases,
+                                    'activation_names': policy.activation_names},
+                    'exploration_noise_momentum': exploration_noise_momentum,
+                    'num_steps': num_steps_per_actor,
+                    'num_steps_per_message': actor_learner_args['num_steps_per_message'],
+                    'experience_queue': experience_queue,
+                    'weights_queue': weights_queues[actor_id],
+                    'stop_event': stop_event,
+                },
+                daemon=True,
+            )
+            for actor_id, exploration_noise_momentum in enumerate(self.get_exploration_noise_momenta(num_actors))
+        ]
+        for actor in actors:
+            actor.start()
+
+        def publish_policy() -> None:
+            policy.set_weights_from_keras(policy_network)
+            for weights_queue in weights_queues:
+                try:  # replace weights the actor has not picked up yet
+                    weights_queue.get_nowait()
+                except Empty:
+                    pass
+                try:
+                    weights_queue.put_nowait((num_updates, policy.kernels, policy.biases))
+                except Full:  # lost the race against the actor, it will pick up the next publish
+                    pass
+
+        num_updates = 0
+        num_updates_published = 0
+        num_actor_steps = 0
+        num_actors_finished = 0
+        rewards = []
+        staleness_per_message = []
+        steps_per_message = []
+
+        real_time_start = perf_counter()
+        try:
+            while num_actors_finished < num_actors:
+
+                # COLLECT EXPERIENCES, wait for them only while there is too little to train on
+                messages = []
+                try:
+                    if allocator.experience_buffer.get_len() < minimum_experiences:
+                        messages.append(experience_queue.get(timeout=10.0))
+                    while True:
+                        messages.append(experience_queue.get_nowait())
+                except Empty:
+                    pass
+                if any(actor.exitcode not in (None, 0) for actor in actors):
+                    raise RuntimeError(f'actor processes failed, exit codes {[actor.exitcode for actor in actors]}')
+
+                for message in messages:
+                    allocator.add_experiences(experiences=message['experiences'])
+                    num_message_steps = len(message['experiences']['reward'])
+                    num_actor_steps += num_message_steps
+                    num_actors_finished += message['finished']
+                    rewards.append(message['experiences']['reward'])
+                    staleness_per_message.append(num_updates - message['policy_version'])
+                    steps_per_message.append(num_message_steps)
+
+                # TRAIN
+                if allocator.experience_buffer.get_len() >= minimum_experiences:
+                    if allocator.train_many(num_updates=updates_per_call):
+                        num_updates += updates_per_call
+
+                    if num_updates - num_updates_published >= actor_learner_args['policy_sync_interval_updates']:
+                        publish_policy()
+                        num_updates_published = num_updates
+
+                if len(messages) > 0:
+                    print(f'\rActor steps: {num_actor_steps / (num_actors * num_steps_per_actor):.2%}, '
+                          f'learner updates: {num_updates}', end='')
+        finally:
+            allocator.stop_batch_prefetcher()
+            stop_event.set()
+            for actor in actors:
+                actor.join(timeout=10.0)
+                if actor.is_alive():
+                    actor.terminate()
+        print('\n')
+        real_time_seconds = perf_counter() - real_time_start
+
+        policy_path = Path(self.config.models_path, training_name, 'policy')
+        policy_network.save(policy_path)
+        copytree(Path(self.config.project_root_path, 'src', 'config'),
+                 Path(policy_path, 'config'),
+                 dirs_exist_ok=True)
+
+        staleness_per_message = array(staleness_per_message)
+        report = {
+            'actor_steps_per_second': num_actor_steps / real_time_seconds,
+            'learner_updates_per_second': num_updates / real_time_seconds,
+            'policy_staleness_updates_mean': float(np_sum(staleness_per_message * array(steps_per_message))
+                                                   / num_actor_steps),
+            'policy_staleness_updates_max': float(np_max(staleness_per_message)),
+            'reward_per_step': float(mean(concatenate(rewards))),
+        }
+        for key, value in report.items():
+            self.config.logger.info(f'{key}: {value:.4g}')
+
+        return report
+
+
+if __name__ == '__main__':
+
+    r = ActorLearnerRunner()
+    r.train_distributed(training_name='actor_learner')
@@ -0,0 +1,110 @@
+
+from logging import (
+    Logger,
+)
+from numpy.random import (
+    default_rng,
+)
+from queue import (
+    Queue,
+    Full,
+)
+from threading import (
+    Thread,
+)
+from time import (
+    perf_counter,
+)
+
+
+class BatchPrefetcher:
+    """
+    Prepares training batches on a background thread. While the training thread runs a gradient step,
+    which releases the GIL inside tensorflow, the worker samples the next batches from the experience
+    buffer and converts them to float32 tensors, keeping up to num_prefetch_batches ready in a queue.
+    """
+
+    def __init__(
+            self,
+            prepare_batch: callable,  # prepare_batch(rng) returns one ready-to-train batch
+            num_prefetch_batches: int,
+            rng: default_rng,  # used by the worker only
+            parent_logger: Logger,
+    ) -> None:
+
+        self.logger: Logger = parent_logger.getChild(__name__)
+
+        self.prepare_batch: callable = prepare_batch
+        self.rng: default_rng = rng
+        self.batch_queue: Queue = Queue(maxsize=num_prefetch_batches)
+
+        self.worker: Thread | None = None
+        self.running: bool = False
+
+        # Instrumentation
+        self.num_batches_prepared: int = 0
+        self.seconds_preparing: float = 0.0  # time spent by the worker, hidden from the training thread
+
+    def start(
+            self,
+    ) -> None:
+        self.running = True
+        self.worker = Thread(target=self._work, daemon=True)
+        self.worker.start()
+        self.logger.info(f'Batch prefetcher started, prefetching {self.batch_queue.maxsize} batches')
+
+    def _work(
+            self,
+    ) -> None:
+        while self.running:
+            time_start = perf_counter()
+            try:
+                batch = self.prepare_batch(rng=self.rng)
+            except Exception as exception:
+                # hand the error to the training thread, which would otherwise wait for a batch forever
+                self._put(exception)
+                return
+            self.seconds_preparing += perf_counter() - time_start
+            self.num_batches_prepared += 1
+
+            self._put(batch)
+
+    def _put(
+            self,
+            item,  # batch or exception
+    ) -> None:
+        while self.running:  # wake up regularly to notice stop while the queue is full
+            try:
+                self.batch_queue.put(item, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def get_batch(
+            self,
+    ) -> tuple:
+        if self.worker is None:
+            self.start()
+
+        batch = self.batch_queue.get()
+        if isinstance(batch, Exception):
+            self.stop()
+            raise RuntimeError('Preparing a batch in the background failed') from batch
+
+        return batch
+
+    def stop(
+            self,
+    ) -> None:
+        """
+        End the worker and drop the prefetched batches. The next get_batch starts a new worker.
+        """
+
+        if self.worker is None:
+            return
+        self.running = False
+        self.worker.join()
+        self.worker = None
+        while not self.batch_queue.empty():
+            self.batch_queue.get_nowait()
+        self.logger.info('Batch prefetcher stopped')
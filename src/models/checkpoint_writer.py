@@ -0,0 +1,72 @@
+
+from logging import (
+    Logger,
+)
+from queue import (
+    Queue,
+)
+from threading import (
+    Thread,
+)
+from time import (
+    perf_counter,
+)
+
+
+class CheckpointWriter:
+    """
+    Writes checkpoints on a background thread. The training thread only captures the state to be saved
+    into host memory and submits a write function for it, serialization to disk happens while training
+    continues. Writes run in submission order.
+    """
+
+    def __init__(
+            self,
+            parent_logger: Logger,
+            max_pending_writes: int = 2,  # submitting more blocks the training thread until a write finishes
+    ) -> None:
+
+        self.logger: Logger = parent_logger.getChild(__name__)
+
+        self.write_queue: Queue = Queue(maxsize=max_pending_writes)
+        self.worker: Thread = Thread(target=self._work, daemon=True)
+        self.worker.start()
+
+        # Instrumentation
+        self.num_writes: int = 0
+        self.seconds_writing: float = 0.0  # time spent by the worker, hidden from the training thread
+        self.num_failed_writes: int = 0
+
+    def _work(
+            self,
+    ) -> None:
+        while True:
+            write, description = self.write_queue.get()
+            time_start = perf_counter()
+            try:
+                write()
+            except Exception as exception:
+                # a failed checkpoint must not end training, the next checkpoint may succeed
+                self.num_failed_writes += 1
+                self.logger.error(f'Writing {description} failed: {exception!r}')
+            else:
+                self.num_writes += 1
+                self.seconds_writing += perf_counter() - time_start
+                self.logger.debug(f'Wrote {description} in {perf_counter() - time_start:.3f} s')
+            self.write_queue.task_done()
+
+    def submit(
+            self,
+            write: callable,  # writes state that was already captured, must not touch live training state
+            description: str,
+    ) -> None:
+        self.write_queue.put((write, description))
+
+    def wait(
+            self,
+    ) -> None:
+        """
+        Block until all submitted writes are finished, e.g., before the process exits.
+        """
+
+        self.write_queue.join()
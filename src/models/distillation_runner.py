@@ -0,0 +1,228 @@
+
+from numpy import (
+    ndarray,
+    array,
+    newaxis,
+    mean,
+    abs as np_abs,
+    max as np_max,
+    sum as np_sum,
+    nan,
+)
+from pathlib import (
+    Path,
+)
+from keras.losses import (
+    KLDivergence,
+)
+
+from src.config.config import (
+    Config,
+)
+from src.data.scheduling_data import (
+    SchedulingData,
+)
+from src.models.dqn import (
+    PolicyNetwork,
+)
+from src.models.policy_snapshot import (
+    load_policy_network,
+    write_policy_snapshot,
+)
+from src.models.numpy_policy import (
+    NumpyPolicy,
+)
+from src.models.training_runner import (
+    add_random_distribution,
+)
+from src.utils.measure_latency_us import (
+    measure_latency_us,
+)
+
+
+def get_directory_size_bytes(
+        path: Path,
+) -> int:
+    return sum(file.stat().st_size for file in path.rglob('*') if file.is_file())
+
+
+def collect_states(
+        config: Config,
+        policy,  # any policy with get_action(state)
+        num_states: int,
+        exploration_noise_momentum: float,
+) -> ndarray:
+    """
+    States visited by the sim when acting with noisy allocations of policy.
+    """
+
+    sim = SchedulingData(config=config)
+
+    states = []
+    for _ in range(num_states):
+        state = sim.get_state()
+        states.append(state)
+        action = add_random_distribution(rng=config.rng,
+                                         action=policy.get_action(state),
+                                         tau_momentum=exploration_noise_momentum)
+        sim.step(percentage_allocation_solution=action)
+
+    return array(states, dtype='float32')
+
+
+def evaluate_reward_parity(
+        config: Config,
+        reference_policy,  # any policy with get_action(state)
+        candidate_policy,
+        num_evaluation_steps: int,
+) -> dict:
+    """
+    Step copies of the same sim state with the reference, the candidate and a random allocation, like the GUI
+    does for its learned agents, and advance the sim with the reference allocation. Rewards may be negative,
+    so parity is the candidate's share of the reference's reward gain over random allocations.
+    """
+
+    def allocate_random(
+            state: ndarray,
+    ) -> ndarray:
+        shares = config.rng.random(len(state) // 3, dtype='float32')
+        return shares / np_sum(shares)
+
+    sim = SchedulingData(config=config)
+    secondary_simulations = {'reference': SchedulingData(config=config),
+                             'candidate': SchedulingData(config=config),
+                             'random': SchedulingData(config=config)}
+    allocators = {'reference': reference_policy.get_action,
+                  'candidate': candidate_policy.get_action,
+                  'random': allocate_random}
+
+    rewards: dict = {'reference': [], 'candidate': [], 'random': []}
+    action_deviations = []
+    states = []
+    for _ in range(num_evaluation_steps):
+        state = sim.get_state()
+        states.append(state)
+        actions = {}
+        for allocator_name, allocate in allocators.items():
+            secondary_simulations[allocator_name].import_state(state=sim.export_state())
+            actions[allocator_name] = allocate(state)
+            reward, _ = secondary_simulations[allocator_name].step(
+                percentage_allocation_solution=actions[allocator_name])
+            rewards[allocator_name].append(reward)
+        action_deviations.append(np_abs(actions['reference'] - actions['candidate']))
+        sim.step(percentage_allocation_solution=actions['reference'])
+
+    reward_per_step = {allocator_name: float(mean(allocator_rewards))
+                       for allocator_name, allocator_rewards in rewards.items()}
+
+    # a reference that does not clearly beat random allocations leaves no gain to compare against
+    reward_gain_reference = reward_per_step['reference'] - reward_per_step['random']
+    if reward_gain_reference > 0.01 * abs(reward_per_step['random']):
+        reward_parity = (reward_per_step['candidate'] - reward_per_step['random']) / reward_gain_reference
+    else:
+        reward_parity = nan
+        config.logger.warning(f'reward parity undefined, the reference gains {reward_gain_reference:.4g} '
+                              f'reward per step over random allocations')
+
+    return {
+        'reward_per_step_reference': reward_per_step['reference'],
+        'reward_per_step_candidate': reward_per_step['candidate'],
+        'reward_per_step_random': reward_per_step['random'],
+        'reward_difference': reward_per_step['candidate'] - reward_per_step['reference'],
+        'reward_parity': reward_parity,
+        'action_mean_absolute_deviation': float(mean(action_deviations)),
+        'action_max_absolute_deviation': float(np_max(action_deviations)),
+        'states': array(states, dtype='float32'),
+    }
+
+
+class DistillationRunner:
+    """
+    Distill a trained policy into a small student network that imitates its allocations.
+    """
+
+    def __init__(
+            self,
+            config: Config | None = None,  # by default a fresh Config
+    ) -> None:
+
+        self.config = config if config is not None else Config()
+        self.rng = self.config.rng
+
+    def distill(
+            self,
+            teacher_path: Path,  # saved PolicyNetwork
+            student_name: str,
+    ) -> dict:
+
+        distillation_args = self.config.distillation_args
+        policy_network_args = self.config.network_args['policy_network_args']
+
+        teacher_network = load_policy_network(teacher_path)
+        teacher = NumpyPolicy.from_keras(teacher_network)
+
+        # LABEL STATES
+        states = collect_states(config=self.config,
+                                policy=teacher,
+                                num_states=distillation_args['num_states'],
+                                exploration_noise_momentum=distillation_args['exploration_noise_momentum'])
+        teacher.verify(network=teacher_network, states=states[:100])
+        teacher_actions = teacher.call(states)
+
+        # TRAIN STUDENT
+        #  on the teacher's softmax outputs, the KL divergence is the cross entropy up to the teacher's entropy
+        student_network_args = {
+            'num_actions': int(teacher_actions.shape[1]),
+            'hidden_layer_units': distillation_args['student_hidden_layer_units'],
+            'activation_hidden': policy_network_args['activation_hidden'],
+            'kernel_initializer_hidden': policy_network_args['kernel_initializer_hidden'],
+        }
+        student_network = PolicyNetwork(**student_network_args)
+        student_network.initialize_inputs(states[:1])
+        student_network.compile(
+            optimizer=distillation_args['student_optimizer'](**distillation_args['student_optimizer_args']),
+            loss=KLDivergence(),
+        )
+        history = student_network.fit(
+            x=states,
+            y=teacher_actions,
+            batch_size=distillation_args['training_batch_size'],
+            epochs=distillation_args['num_epochs'],
+            validation_split=0.1,
+            verbose=0,
+        )
+
+        student_path = Path(self.config.models_path, student_name, 'policy')
+        write_policy_snapshot(snapshot_path=student_path,
+                              weights=student_network.get_weights(),
+                              network_class_name=type(student_network).__name__,
+                              network_args=student_network_args,
+                              config_path=Path(self.config.project_root_path, 'src', 'config'))
+
+        # REPORT
+        student = NumpyPolicy.from_keras(student_network)
+        report = evaluate_reward_parity(config=self.config,
+                                        reference_policy=teacher,
+                                        candidate_policy=student,
+                                        num_evaluation_steps=distillation_args['num_evaluation_steps'])
+        evaluation_states = report.pop('states')
+
+        report['validation_kl_divergence'] = float(history.history['val_loss'][-1])
+        for policy_name, network, policy in [('teacher', teacher_network, teacher),
+                                             ('student', student_network, student)]:
+            report[f'latency_us_keras_{policy_name}'] = measure_latency_us(
+                lambda state: network.call(state[newaxis]).numpy().squeeze(), evaluation_states)
+            report[f'latency_us_numpy_{policy_name}'] = measure_latency_us(policy.get_action, evaluation_states)
+        report['saved_size_bytes_teacher'] = get_directory_size_bytes(Path(teacher_path))
+        report['saved_size_bytes_student'] = get_directory_size_bytes(student_path)
+
+        for key, value in report.items():
+            self.config.logger.info(f'{key}: {value:.4g}')
+
+        return report
+
+
+if __name__ == '__main__':
+
+    r = DistillationRunner()
+    r.distill(teacher_path=Path(r.config.models_path, 'max_sumrate', 'policy'), student_name='max_sumrate_student')
@@ -7,6 +7,25 @@ from src.models.activation_functions import (
     activation_penalized_tanh,
 )
 
+# All network functions take float32 batches [batch, features]. Fixing the signature traces each function once,
+#  instead of retracing whenever the batch size or the input dtype changes
+batch_input_signature = [tf.TensorSpec(shape=[None, None], dtype=tf.float32)]
+
+
+def build_layers(
+        layers: list,
+        inputs,
+) -> tf.Tensor:
+    """
+    Build a stack of layers eagerly on a concrete input. The traced functions only know the input rank,
+    while the layers need the size of the feature dimension to create their weights.
+    """
+    x = tf.cast(inputs, tf.float32)
+    for layer in layers:
+        x = layer(x)
+
+    return x
+
 
 class ValueNetwork(tf.keras.Model, ABC):
 
@@ -36,7 +55,123 @@ class ValueNetwork(tf.keras.Model, ABC):
         self.output_layer = tf.keras.layers.Dense(1, dtype=tf.float32)
         # --------------------------------------------------------------------------------------------------------------
 
-    @tf.function
+    @tf.function(input_signature=batch_input_signature)
+    def call(
+            self,
+            inputs
+    ) -> tf.Tensor:
+        x = inputs
+        for layer in self.hidden_layers:
+            x = layer(x)
+        output = self.output_layer(x)
+
+        return output
+
+    def initialize_inputs(
+            self,
+            inputs
+    ) -> None:
+        """
+        Ensure each method is traced once for saving
+        """
+        build_layers([*self.hidden_layers, self.output_layer], inputs)
+        self(inputs)
+        self.call(inputs)
+
+
+class DenseEnsemble(tf.keras.layers.Layer):
+    """
+    num_members independent Dense layers with stacked weights, evaluated as one batched matmul.
+    Accepts a shared input [batch, units_in] or per-member inputs [num_members, batch, units_in]
+    and returns [num_members, batch, units].
+    """
+
+    def __init__(
+            self,
+            num_members: int,
+            units: int,
+            activation=None,
+            kernel_initializer: str = 'glorot_uniform',
+    ) -> None:
+        super().__init__()
+        self.num_members: int = num_members
+        self.units: int = units
+        self.activation = tf.keras.activations.get(activation)
+        self.kernel_initializer = tf.keras.initializers.get(kernel_initializer)
+
+    def build(
+            self,
+            input_shape,
+    ) -> None:
+        units_in = int(input_shape[-1])
+
+        # initialize each member like a regular Dense kernel, a [num_members, units_in, units] initializer
+        #  would count num_members into the fan in and out
+        def kernel_initializer(shape, dtype=None):
+            return tf.stack([self.kernel_initializer(shape=shape[1:], dtype=dtype) for _ in range(shape[0])])
+
+        self.kernel = self.add_weight(name='kernel', shape=(self.num_members, units_in, self.units),
+                                      initializer=kernel_initializer, trainable=True)
+        self.bias = self.add_weight(name='bias', shape=(self.num_members, 1, self.units),
+                                    initializer='zeros', trainable=True)
+
+    def call(
+            self,
+            inputs,
+    ) -> tf.Tensor:
+        if inputs.shape.ndims == 2:
+            x = tf.einsum('bi,nio->nbo', inputs, self.kernel)
+        else:
+            x = tf.einsum('nbi,nio->nbo', inputs, self.kernel)
+
+        return self.activation(x + self.bias)
+
+    def call_member(
+            self,
+            inputs,  # [batch, units_in]
+            member_id: int,
+    ) -> tf.Tensor:
+        """
+        Evaluate one member only, on its slice of the stacked weights, returns [batch, units].
+        """
+
+        return self.activation(tf.matmul(inputs, self.kernel[member_id]) + self.bias[member_id])
+
+
+class ValueNetworkEnsemble(tf.keras.Model, ABC):
+    """
+    num_networks value networks in one model. Every layer stacks the weights of all members,
+    so the whole ensemble is evaluated in one forward pass, output shape [num_networks, batch, 1].
+    """
+
+    def __init__(
+            self,
+            num_networks: int,
+            hidden_layer_units: list,
+            activation_hidden: str,
+            kernel_initializer_hidden: str
+    ):
+        super().__init__()
+        # Activation----------------------------------------------------------------------------------------------------
+        if activation_hidden == 'penalized_tanh':
+            activation_hidden = activation_penalized_tanh
+        # --------------------------------------------------------------------------------------------------------------
+
+        # Layers--------------------------------------------------------------------------------------------------------
+        self.hidden_layers = []
+        for size in hidden_layer_units:
+            self.hidden_layers.append(
+                DenseEnsemble(
+                    num_members=num_networks,
+                    units=size,
+                    activation=activation_hidden,
+                    kernel_initializer=kernel_initializer_hidden,  # default: 'glorot_uniform'
+                ))
+
+        self.output_layer = DenseEnsemble(num_members=num_networks, units=1)
+        # --------------------------------------------------------------------------------------------------------------
+
+    @tf.function(input_signature=batch_input_signature)
     def call(
             self,
             inputs
@@ -48,6 +183,21 @@ class ValueNetwork(tf.keras.Model, ABC):
 
         return output
 
+    def call_member(
+            self,
+            inputs,
+            member_id: int,
+    ) -> tf.Tensor:
+        """
+        Evaluate one network of the ensemble, output shape [batch, 1]. Not a graph function of its own,
+        call it from within a traced function.
+        """
+        x = inputs
+        for layer in self.hidden_layers:
+            x = layer.call_member(x, member_id=member_id)
+
+        return self.output_layer.call_member(x, member_id=member_id)
+
     def initialize_inputs(
             self,
             inputs
@@ -55,6 +205,7 @@ class ValueNetwork(tf.keras.Model, ABC):
         """
         Ensure each method is traced once for saving
         """
+        build_layers([*self.hidden_layers, self.output_layer], inputs)
         self(inputs)
         self.call(inputs)
 
@@ -88,7 +239,7 @@ class PolicyNetwork(tf.keras.Model, ABC):
         self.output_layer = tf.keras.layers.Dense(num_actions, activation='softmax', dtype=tf.float32)
         # --------------------------------------------------------------------------------------------------------------
 
-    @tf.function
+    @tf.function(input_signature=batch_input_signature)
     def call(
             self,
             inputs,
@@ -107,6 +258,7 @@ class PolicyNetwork(tf.keras.Model, ABC):
         """
         Ensure each method is traced once for saving
         """
+        build_layers([*self.hidden_layers, self.output_layer], inputs)
         self(inputs)
         self.call(inputs)
 
@@ -136,12 +288,10 @@ class PolicyNetworkSoft(tf.keras.Model, ABC):
 
         self.output_layer_softmax = tf.keras.layers.Dense(units=num_actions, dtype=tf.float32, activation='softmax')
 
-    @tf.function
+    @tf.function(input_signature=batch_input_signature)
     def call(
             self,
             inputs,
-            training=None,
-            masks=None,
     ) -> tuple[tf.Tensor, tf.Tensor]:
         x = inputs
         for layer in self.hidden_layers:
@@ -158,14 +308,11 @@ class PolicyNetworkSoft(tf.keras.Model, ABC):
             log_stds
         )
 
-    @tf.function
+    @tf.function(input_signature=batch_input_signature)
     def get_action_and_log_prob_density(
             self,
             state,
     ) -> tuple[tf.Tensor, tf.Tensor, tf.Tensor]:
-        if state.shape.ndims == 1:
-            state = tf.expand_dims(state, axis=0)
-
         means, log_stds = self.call(state)
         stds = tf.exp(log_stds)
         distributions = tf_distributions.Normal(loc=means, scale=stds)
@@ -181,3 +328,18 @@ class PolicyNetworkSoft(tf.keras.Model, ABC):
             action_log_prob_densities,
             actions_softmax,
         )
+
+    def initialize_inputs(
+            self,
+            inputs
+    ) -> None:
+        """
+        Ensure each method is traced once for saving
+        """
+        x = build_layers(self.hidden_layers, inputs)
+        means = self.output_layer_means(x)
+        self.output_layer_log_stds(x)
+        self.output_layer_softmax(means)
+        self(inputs)
+        self.call(inputs)
+        self.get_action_and_log_prob_density(inputs)
@@ -0,0 +1,285 @@
+
+class IndexedMinHeap:
+    """
+    Binary min-heap over buffer slots, keyed by, e.g., the buffer priorities. Keys are compared with <,
+    so tuples break ties by their later entries. Keeps the heap position of every slot so that the key
+    of any slot can be updated in O(log n).
+    """
+
+    def __init__(
+            self,
+    ) -> None:
+        self.keys: dict = {}  # slot -> key
+        self.heap: list = []  # heap position -> slot
+        self.positions: dict = {}  # slot -> heap position
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def peek(self) -> int:
+        return self.heap[0]
+
+    def push(
+            self,
+            slot: int,
+            key,
+    ) -> None:
+        self.keys[slot] = key
+        self.heap.append(slot)
+        self.positions[slot] = len(self.heap) - 1
+        self._sift_up(len(self.heap) - 1)
+
+    def update(
+            self,
+            slot: int,
+            key,
+    ) -> None:
+        self.keys[slot] = key
+        position = self.positions[slot]
+        self._sift_up(position)
+        self._sift_down(self.positions[slot])
+
+    def rebuild(
+            self,
+            keys: dict,
+    ) -> None:
+        self.keys = dict(keys)
+        self.heap = list(self.keys.keys())
+        self.positions = {slot: position for position, slot in enumerate(self.heap)}
+        for position in reversed(range(len(self.heap) // 2)):
+            self._sift_down(position)
+
+    def _swap(
+            self,
+            position_a: int,
+            position_b: int,
+    ) -> None:
+        self.heap[position_a], self.heap[position_b] = self.heap[position_b], self.heap[position_a]
+        self.positions[self.heap[position_a]] = position_a
+        self.positions[self.heap[position_b]] = position_b
+
+    def _sift_up(
+            self,
+            position: int,
+    ) -> None:
+        while position > 0:
+            parent = (position - 1) // 2
+            if self.keys[self.heap[position]] >= self.keys[self.heap[parent]]:
+                break
+            self._swap(position, parent)
+            position = parent
+
+    def _sift_down(
+            self,
+            position: int,
+    ) -> None:
+        while True:
+            smallest = position
+            for child in [2 * position + 1, 2 * position + 2]:
+                if child < len(self.heap) and self.keys[self.heap[child]] < self.keys[self.heap[smallest]]:
+                    smallest = child
+            if smallest == position:
+                break
+            self._swap(position, smallest)
+            position = smallest
+
+
+class EvictionFIFO:
+    """
+    Overwrite the oldest experience.
+    """
+
+    def __init__(
+            self,
+            buffer,
+    ) -> None:
+        self.buffer = buffer
+
+    def get_write_slot(self) -> int | None:
+        return self.buffer.write_pointer
+
+    def on_slot_written(
+            self,
+            slot: int,
+    ) -> None:
+        pass
+
+    def on_priorities_adjusted(
+            self,
+            slots,
+    ) -> None:
+        pass
+
+    def get_state(self) -> dict:
+        return {}
+
+    def set_state(
+            self,
+            state: dict,
+    ) -> None:
+        pass
+
+
+class EvictionReservoir(EvictionFIFO):
+    """
+    Reservoir sampling: once the buffer is full, the n-th experience replaces a uniformly chosen slot with
+    probability buffer_size / n and is discarded otherwise. The buffer then holds a uniform sample of all
+    experiences seen so far instead of only the most recent ones.
+    """
+
+    def __init__(
+            self,
+            buffer,
+    ) -> None:
+        super().__init__(buffer=buffer)
+        self.num_experiences_seen: int = 0
+
+    def get_write_slot(self) -> int | None:
+        self.num_experiences_seen += 1
+        if self.num_experiences_seen <= self.buffer.buffer_size:
+            return self.num_experiences_seen - 1
+
+        slot = int(self.buffer.rng.integers(0, self.num_experiences_seen))
+        if slot < self.buffer.buffer_size:
+            return slot
+
+        return None
+
+    def get_state(self) -> dict:
+        return {'num_experiences_seen': self.num_experiences_seen}
+
+    def set_state(
+            self,
+            state: dict,
+    ) -> None:
+        self.num_experiences_seen = state['num_experiences_seen']
+
+
+class EvictionLowestPriority(EvictionFIFO):
+    """
+    Overwrite the experience of lowest priority, found via an indexed min-heap over the buffer priorities.
+    Among equal priorities, e.g., while priorities are never adjusted, the oldest experience is overwritten.
+    """
+
+    def __init__(
+            self,
+            buffer,
+    ) -> None:
+        super().__init__(buffer=buffer)
+        self.heap: IndexedMinHeap = IndexedMinHeap()
+        self.num_writes: int = 0
+        self.write_ids: list = [-1] * self.buffer.buffer_size  # slot -> num_writes when it was written
+
+    def _get_key(
+            self,
+            slot: int,
+    ) -> tuple:
+        return self.buffer.priorities[slot], self.write_ids[slot]
+
+    def get_write_slot(self) -> int | None:
+        if len(self.heap) < self.buffer.buffer_size:
+            return len(self.heap)
+
+        return self.heap.peek()
+
+    def on_slot_written(
+            self,
+            slot: int,
+    ) -> None:
+        self.write_ids[slot] = self.num_writes
+        self.num_writes += 1
+        if slot in self.heap.positions:
+            self.heap.update(slot, key=self._get_key(slot))
+        else:
+            self.heap.push(slot, key=self._get_key(slot))
+
+    def on_priorities_adjusted(
+            self,
+            slots,
+    ) -> None:
+        for slot in slots:
+            self.heap.update(int(slot), key=self._get_key(int(slot)))
+
+    def get_state(self) -> dict:
+        return {'write_ids': self.write_ids}
+
+    def set_state(
+            self,
+            state: dict,
+    ) -> None:
+        self.write_ids = list(state['write_ids'])
+        self.num_writes = max(self.write_ids) + 1
+        self.heap.rebuild({slot: self._get_key(slot)
+                           for slot in range(self.buffer.buffer_size) if self.buffer.priorities[slot] > 0})
+
+
+class EvictionAgeStratified(EvictionFIFO):
+    """
+    Split the buffer into age strata of equal size, up to one slot, each a FIFO ring.
+    New experiences enter the first stratum.
+    The oldest experience of a full stratum is promoted into the next stratum with promotion_probability
+    and discarded otherwise, so each stratum covers a longer stretch of history than the one before.
+    A promotion cascade touches at most one slot per stratum.
+    """
+
+    def __init__(
+            self,
+            buffer,
+            num_strata: int = 4,
+            promotion_probability: float = 0.5,
+    ) -> None:
+        super().__init__(buffer=buffer)
+        if self.buffer.buffer_size < num_strata:
+            raise ValueError(f'age stratified eviction needs at least one slot per stratum, '
+                             f'buffer_size {self.buffer.buffer_size} < num_strata {num_strata}')
+        self.num_strata: int = num_strata
+        self.promotion_probability: float = promotion_probability
+
+        # the first strata take one slot each of what is left over
+        self.stratum_sizes: list = [self.buffer.buffer_size // self.num_strata
+                                    + (stratum_id < self.buffer.buffer_size % self.num_strata)
+                                    for stratum_id in range(self.num_strata)]
+        self.stratum_starts: list = [sum(self.stratum_sizes[:stratum_id]) for stratum_id in range(self.num_strata)]
+        self.stratum_pointers: list = [0] * self.num_strata
+
+    def _advance_stratum(
+            self,
+            stratum_id: int,
+    ) -> int:
+        slot = self.stratum_starts[stratum_id] + self.stratum_pointers[stratum_id]
+        self.stratum_pointers[stratum_id] = (self.stratum_pointers[stratum_id] + 1) % self.stratum_sizes[stratum_id]
+
+        return slot
+
+    def get_write_slot(self) -> int | None:
+        # Find the chain of oldest experiences that are promoted to make room
+        promotion_chain = [self._advance_stratum(0)]
+        while (
+                self.buffer.priorities[promotion_chain[-1]] > 0  # slot holds an experience
+                and len(promotion_chain) < self.num_strata
+                and self.buffer.rng.random() < self.promotion_probability
+        ):
+            promotion_chain.append(self._advance_stratum(len(promotion_chain)))
+
+        # Move from the oldest stratum down, the last slot in the chain is overwritten
+        for target_slot, source_slot in zip(reversed(promotion_chain[1:]), reversed(promotion_chain[:-1])):
+            self.buffer.move_experience(source_slot=source_slot, target_slot=target_slot)
+
+        return promotion_chain[0]
+
+    def get_state(self) -> dict:
+        return {'stratum_pointers': self.stratum_pointers}
+
+    def set_state(
+            self,
+            state: dict,
+    ) -> None:
+        self.stratum_pointers = state['stratum_pointers']
+
+
+eviction_policies: dict = {
+    'fifo': EvictionFIFO,
+    'reservoir': EvictionReservoir,
+    'lowest_priority': EvictionLowestPriority,
+    'age_stratified': EvictionAgeStratified,
+}
@@ -1,7 +1,32 @@
 
+from copy import (
+    deepcopy,
+)
+from json import (
+    dump as json_dump,
+    load as json_load,
+)
+from pathlib import (
+    Path,
+)
+from shutil import (
+    rmtree,
+)
+from threading import (
+    Lock,
+)
 from numpy import (
     ndarray,
     zeros,
+    flatnonzero,
+    array,
+    arange,
+    ones,
+    asarray,
+    stack,
+    save as np_save,
+    load as np_load,
+    array_equal,
     sum as np_sum,
     divide as np_divide,
     power as np_power,
@@ -9,7 +34,11 @@ from numpy import (
     where as np_where,
     count_nonzero as np_count_nonzero,
 )
-from numpy.random import default_rng
+from numpy.random import default_rng, Generator
+
+from src.models.eviction_policies import (
+    eviction_policies,
+)
 
 
 class ExperienceBuffer:
@@ -19,12 +48,17 @@ class ExperienceBuffer:
             buffer_size: int,
             priority_scale_alpha: float,  # alpha=0 is uniform sampling, alpha=1 is fully prioritized sampling
             importance_sampling_correction_beta: float,  # beta=1 is full correction, beta=0 is no correction
+            compact_storage: bool = False,  # states as uint8 codes, actions as float16
+            sequential_storage: bool = False,  # store each observation once, next_state is looked up by index
+            state_interning: bool = False,  # store each unique state once, experiences hold state ids
+            eviction_policy: str = 'fifo',  # which experience to overwrite, see eviction_policies
     ) -> None:
         self.rng: default_rng = rng
         self.write_pointer: int = 0
 
         self.buffer_size = buffer_size
-        self.buffer: list = [{}] * self.buffer_size
+        # Experiences are stored column-wise, one array per experience key, allocated on the first add
+        self.buffer: dict = {}
         self.priorities: ndarray = zeros(self.buffer_size, dtype='float32')
         self.probabilities: ndarray = zeros(self.buffer_size, dtype='float32')  # prob_i = prio_i / sum_i(prio_i)
 
@@ -33,37 +67,361 @@ class ExperienceBuffer:
         self.min_priority: float = 1e-20
         self.max_priority: float = self.min_priority
 
+        # States from SchedulingData.get_state are small integers (power gains 1..16, job sizes, 0/1 priority),
+        #  so they fit uint8 codes losslessly. Actions are stored at half precision. Sampled batches are
+        #  always decoded to float32.
+        self.compact_storage: bool = compact_storage
+        self.storage_dtypes: dict = {
+            'state': 'float32',
+            'action': 'float32',
+            'reward': 'float32',
+            'next_state': 'float32',
+        }
+        if self.compact_storage:
+            self.storage_dtypes['state'] = 'uint8'
+            self.storage_dtypes['action'] = 'float16'
+            self.storage_dtypes['next_state'] = 'uint8'
+
+        # The next_state of step t is the state of step t+1. In sequential storage, only states are stored
+        #  and the next_state of slot i is read from slot i+1. Slots whose successor slot does not hold their
+        #  next_state, i.e., episode boundaries and the most recent experience, are flagged and keep their
+        #  next_state in a small side table.
+        self.sequential_storage: bool = sequential_storage
+        self.episode_boundaries: ndarray = zeros(self.buffer_size, dtype='bool')
+        self.boundary_next_states: dict = {}
+
+        # The discrete scenario has few unique states, so the buffer holds many copies of the same state.
+        #  With state interning, each unique state is stored once in a state table and experiences hold
+        #  int32 state ids. Each table entry counts the experiences referencing it and is freed for reuse
+        #  once that count drops to zero. Sampling is unaffected.
+        self.state_interning: bool = state_interning
+        self.state_table: ndarray = zeros((0, 0))
+        self.state_table_size: int = 0  # num of table rows handed out so far
+        self.state_reference_counts: ndarray = zeros(0, dtype='int64')
+        self.state_ids: dict = {}  # state bytes -> state id
+        self.free_state_ids: list = []
+
+        # Eviction policies pick the slot each new experience is written to
+        if sequential_storage and eviction_policy != 'fifo':
+            raise ValueError('sequential storage requires fifo eviction')
+        self.eviction_policy_name: str = eviction_policy
+        self.eviction_policy = eviction_policies[eviction_policy](buffer=self)
+
+        # Guards against sampling from a background thread while experiences are added
+        self.lock: Lock = Lock()
+
     def get_len(self) -> int:
         return np_count_nonzero(self.priorities)
 
+    def get_num_unique_states(self) -> int:
+        return len(self.state_ids)
+
+    def get_memory_size_bytes(self) -> int:
+        memory_size_bytes = sum(column.nbytes for column in self.buffer.values())
+        if self.sequential_storage:
+            memory_size_bytes += self.episode_boundaries.nbytes
+            memory_size_bytes += sum(asarray(next_state).nbytes for next_state in self.boundary_next_states.values())
+        if self.state_interning:
+            memory_size_bytes += self.state_table.nbytes + self.state_reference_counts.nbytes
+
+        return memory_size_bytes
+
+    def _allocate_buffer(
+            self,
+            experience: dict,
+    ) -> None:
+        for key, value in experience.items():
+            if self.sequential_storage and key == 'next_state':
+                continue
+            value = asarray(value)
+            if self.state_interning and key in ['state', 'next_state']:
+                self.buffer[key] = zeros(self.buffer_size, dtype='int32')
+                continue
+            self.buffer[key] = zeros((self.buffer_size, *value.shape),
+                                     dtype=self.storage_dtypes.get(key, 'float32'))
+
+        if self.state_interning:
+            initial_table_size = 1_024
+            self.state_table = zeros((initial_table_size, *asarray(experience['state']).shape),
+                                     dtype=self.storage_dtypes['state'])
+            self.state_reference_counts = zeros(initial_table_size, dtype='int64')
+
+    def _encode(
+            self,
+            key: str,
+            value,
+            batched: bool = False,  # value holds one row per experience
+    ) -> ndarray:
+        encoded = asarray(value).astype(self.storage_dtypes.get(key, 'float32'))
+        if self.compact_storage and key in ['state', 'next_state']:
+            if not array_equal(encoded, value):
+                raise ValueError(f'compact storage expects {key} to hold integers in [0, 255], got {value}')
+        if self.state_interning and key in ['state', 'next_state']:
+            if batched:
+                return array([self._retain_state(state) for state in encoded], dtype='int32')
+            return self._retain_state(encoded)
+
+        return encoded
+
+    def _decode(
+            self,
+            key: str,
+            values: ndarray,
+    ) -> ndarray:
+        if self.state_interning and key in ['state', 'next_state']:
+            values = self.state_table[values]
+
+        return values.astype('float32')
+
+    def _retain_state(
+            self,
+            state: ndarray,
+    ) -> int:
+        """
+        Look up the id of a state in the state table, adding it if it is new, and count one more reference.
+        """
+
+        state_bytes = state.tobytes()
+        state_id = self.state_ids.get(state_bytes)
+        if state_id is None:
+            if self.free_state_ids:
+                state_id = self.free_state_ids.pop()
+            else:
+                if self.state_table_size == len(self.state_table):  # grow table, a loaded table may have no rows
+                    num_rows = max(2 * len(self.state_table), 1)
+                    state_table = zeros((num_rows, *state.shape), dtype=self.storage_dtypes['state'])
+                    state_reference_counts = zeros(num_rows, dtype='int64')
+                    if self.state_table_size > 0:
+                        state_table[:self.state_table_size] = self.state_table
+                        state_reference_counts[:self.state_table_size] = self.state_reference_counts
+                    self.state_table = state_table
+                    self.state_reference_counts = state_reference_counts
+                state_id = self.state_table_size
+                self.state_table_size += 1
+            self.state_table[state_id] = state
+            self.state_ids[state_bytes] = state_id
+
+        self.state_reference_counts[state_id] += 1
+
+        return state_id
+
+    def _release_state(
+            self,
+            state_id: int,
+    ) -> None:
+        self.state_reference_counts[state_id] -= 1
+        if self.state_reference_counts[state_id] == 0:
+            del self.state_ids[self.state_table[state_id].tobytes()]
+            self.free_state_ids.append(state_id)
+
+    def _release_slot(
+            self,
+            slot: int,
+    ) -> None:
+        """
+        Drop the state references of the experience about to be overwritten at slot.
+        """
+
+        if self.priorities[slot] == 0:  # slot was never written
+            return
+
+        self._release_state(self.buffer['state'][slot])
+        if not self.sequential_storage:
+            self._release_state(self.buffer['next_state'][slot])
+        elif slot in self.boundary_next_states:
+            self.episode_boundaries[slot] = False
+            self._release_state(self.boundary_next_states.pop(slot))
+
     def add_experience(
             self,
             experience: dict,
     ) -> None:
-        self.buffer[self.write_pointer] = experience
-        self.priorities[self.write_pointer] = self.max_priority
+        with self.lock:
+            if not self.buffer:
+                self._allocate_buffer(experience)
+
+            write_slot = self.eviction_policy.get_write_slot()
+            if write_slot is None:  # policy discards this experience
+                return
+
+            if self.state_interning:
+                self._release_slot(write_slot)
+
+            encoded_experience = {key: self._encode(key, value) for key, value in experience.items()}
+            if self.sequential_storage:
+                self._add_sequential_links(encoded_experience)
+
+            for key, value in encoded_experience.items():
+                self.buffer[key][write_slot] = value
+            self.priorities[write_slot] = self.max_priority
+            self.eviction_policy.on_slot_written(write_slot)
+
+            self.write_pointer = (write_slot + 1) % self.buffer_size
+
+    def add_experiences(
+            self,
+            experiences: dict,  # experience key -> array with one row per experience
+    ) -> None:
+        """
+        Add a batch of experiences, e.g., from many parallel simulations, in one call. With fifo eviction,
+        each column is written by slice assignment, split in two where the batch wraps around the ring end.
+        Other eviction policies decide per experience and add row by row.
+        """
+
+        num_experiences = len(next(iter(experiences.values())))
+        if self.eviction_policy_name != 'fifo':
+            for row_id in range(num_experiences):
+                self.add_experience({key: values[row_id] for key, values in experiences.items()})
+            return
+
+        with self.lock:
+            if num_experiences > self.buffer_size:  # only the most recent experiences would survive
+                experiences = {key: values[-self.buffer_size:] for key, values in experiences.items()}
+                self.write_pointer = (self.write_pointer + num_experiences - self.buffer_size) % self.buffer_size
+                num_experiences = self.buffer_size
+
+            if not self.buffer:
+                self._allocate_buffer({key: values[0] for key, values in experiences.items()})
+
+            write_slots = (self.write_pointer + arange(num_experiences)) % self.buffer_size
+            if self.state_interning:
+                for write_slot in write_slots:
+                    self._release_slot(write_slot)
 
-        self.write_pointer += 1
-        self.write_pointer = self.write_pointer % self.buffer_size
+            encoded_experiences = {key: self._encode(key, values, batched=True) for key, values in experiences.items()}
+            if self.sequential_storage:
+                self._add_sequential_links_batched(encoded_experiences, write_slots=write_slots)
+
+            num_before_wrap = min(num_experiences, self.buffer_size - self.write_pointer)
+            for key, values in encoded_experiences.items():
+                self.buffer[key][self.write_pointer:self.write_pointer + num_before_wrap] = values[:num_before_wrap]
+                self.buffer[key][:num_experiences - num_before_wrap] = values[num_before_wrap:]
+            self.priorities[self.write_pointer:self.write_pointer + num_before_wrap] = self.max_priority
+            self.priorities[:num_experiences - num_before_wrap] = self.max_priority
+
+            self.write_pointer = (self.write_pointer + num_experiences) % self.buffer_size
+
+    def move_experience(
+            self,
+            source_slot: int,
+            target_slot: int,
+    ) -> None:
+        """
+        Copy the experience at source_slot over the experience at target_slot. Used by eviction policies
+        that relocate experiences, not available in sequential storage.
+        """
+
+        if self.state_interning:
+            self._release_slot(target_slot)
+
+        for column in self.buffer.values():
+            column[target_slot] = column[source_slot]
+        self.priorities[target_slot] = self.priorities[source_slot]
+
+        if self.state_interning:  # both slots now reference the states
+            self.state_reference_counts[self.buffer['state'][target_slot]] += 1
+            self.state_reference_counts[self.buffer['next_state'][target_slot]] += 1
+
+    def _add_sequential_links(
+            self,
+            encoded_experience: dict,
+    ) -> None:
+        """
+        Move the next_state out of encoded_experience into the side table and link the previous experience.
+        """
+
+        next_state = encoded_experience.pop('next_state')
+
+        # The previous experience continues into this one if its next_state is this state
+        previous_pointer = (self.write_pointer - 1) % self.buffer_size
+        if self.episode_boundaries[previous_pointer]:
+            if array_equal(self.boundary_next_states[previous_pointer], encoded_experience['state']):
+                self.episode_boundaries[previous_pointer] = False
+                previous_next_state = self.boundary_next_states.pop(previous_pointer)
+                if self.state_interning:
+                    self._release_state(previous_next_state)
+
+        # Until the next experience arrives, this experience's next_state is only known from the side table
+        self.episode_boundaries[self.write_pointer] = True
+        self.boundary_next_states[self.write_pointer] = next_state
+
+    def _add_sequential_links_batched(
+            self,
+            encoded_experiences: dict,
+            write_slots: ndarray,
+    ) -> None:
+        """
+        Batched _add_sequential_links. Experiences continue into the next row of the batch if its state
+        is their next_state, all others keep their next_state in the side table.
+        """
+
+        states = encoded_experiences['state']
+        next_states = encoded_experiences.pop('next_state')
+
+        previous_pointer = (self.write_pointer - 1) % self.buffer_size
+        if self.episode_boundaries[previous_pointer]:
+            if array_equal(self.boundary_next_states[previous_pointer], states[0]):
+                self.episode_boundaries[previous_pointer] = False
+                previous_next_state = self.boundary_next_states.pop(previous_pointer)
+                if self.state_interning:
+                    self._release_state(previous_next_state)
+
+        continues = ones(len(states), dtype='bool')
+        continues[-1] = False  # the last experience's successor is not known yet
+        rows_equal = states[1:] == next_states[:-1]
+        continues[:-1] = rows_equal.all(axis=tuple(range(1, rows_equal.ndim)))  # per row, also for state ids
+
+        self.episode_boundaries[write_slots] = ~continues
+        for row_id in flatnonzero(continues):
+            self.boundary_next_states.pop(write_slots[row_id], None)  # drop side table entry of overwritten slot
+            if self.state_interning:
+                self._release_state(next_states[row_id])
+        for row_id in flatnonzero(~continues):
+            self.boundary_next_states[write_slots[row_id]] = next_states[row_id]
+
+    def _get_next_states(
+            self,
+            experience_ids: ndarray,
+    ) -> ndarray:
+        next_states = self.buffer['state'][(experience_ids + 1) % self.buffer_size]
+        for row_id in flatnonzero(self.episode_boundaries[experience_ids]):
+            next_states[row_id] = self.boundary_next_states[experience_ids[row_id]]
+
+        return next_states
 
     def sample(
             self,
             batch_size: int,
-    ) -> tuple[list, ndarray, ndarray]:
-        # Update Probabilities
-        priority_sum = np_sum(self.priorities)
-        self.probabilities = np_divide(self.priorities, priority_sum, dtype='float32')
-
-        # Sample
-        sample_experience_ids = self.rng.choice(
-            a=self.buffer_size,
-            size=batch_size,
-            replace=False,  # Can an experience id be selected multiple times? Yes/No
-            p=self.probabilities,
-        )
+            reward_weightings: ndarray | None = None,  # relabel rewards from stored reward components, or per row
+            rng: Generator | None = None,  # by default the buffer's rng, e.g., a thread's own rng instead
+    ) -> tuple[dict, ndarray, ndarray]:
+        rng = rng if rng is not None else self.rng
+        with self.lock:
+            # Update Probabilities
+            priority_sum = np_sum(self.priorities)
+            probabilities = np_divide(self.priorities, priority_sum, dtype='float32')
+            self.probabilities = probabilities
+
+            # Sample
+            sample_experience_ids = rng.choice(
+                a=self.buffer_size,
+                size=batch_size,
+                replace=False,  # Can an experience id be selected multiple times? Yes/No
+                p=probabilities,
+            )
 
-        sample_experiences = [self.buffer[ii] for ii in sample_experience_ids]
-        sample_probabilities = self.probabilities[sample_experience_ids]
+            # Gather the sampled rows per column, decoded to float32
+            sample_experiences = {
+                key: self._decode(key, column[sample_experience_ids])
+                for key, column in self.buffer.items()
+            }
+            if self.sequential_storage:
+                sample_experiences['next_state'] = self._decode('next_state',
+                                                                self._get_next_states(sample_experience_ids))
+        if reward_weightings is not None:
+            sample_experiences['reward'] = np_sum(sample_experiences['reward_components'] * reward_weightings,
+                                                  axis=-1, dtype='float32')
+        sample_probabilities = probabilities[sample_experience_ids]
 
         sample_importance_weights = np_power(sample_probabilities,
                                              -self.importance_sampling_correction_beta, dtype='float32')
@@ -82,9 +440,127 @@ class ExperienceBuffer:
             new_priorities: ndarray,
     ) -> None:
         new_priorities = np_power(new_priorities, self.priority_scale_alpha, dtype='float32')
-        self.priorities[experience_ids] = np_where(new_priorities > self.min_priority,
-                                                   new_priorities, self.min_priority)
+        with self.lock:
+            self.priorities[experience_ids] = np_where(new_priorities > self.min_priority,
+                                                       new_priorities, self.min_priority)
+            self.eviction_policy.on_priorities_adjusted(experience_ids)
 
         sample_max_priority = np_max(new_priorities)
         if sample_max_priority > self.max_priority:
             self.max_priority = sample_max_priority
+
+    def save(
+            self,
+            buffer_path: Path,
+    ) -> None:
+        """
+        Write the buffer to buffer_path as one uncompressed .npy file per column plus a small metadata file.
+        Files are first written to a temporary folder, so an interrupted save keeps the previous copy intact.
+        """
+
+        self.write_snapshot(snapshot=self.get_snapshot(copy=False), buffer_path=buffer_path)
+
+    def get_snapshot(
+            self,
+            copy: bool = True,  # copy the arrays, so that the snapshot can be written while training continues
+    ) -> dict:
+        """
+        Everything save writes: arrays by file name, and the metadata.
+        """
+
+        def capture(values: ndarray) -> ndarray:
+            return array(values) if copy else values
+
+        with self.lock:
+            arrays = {f'{key}.npy': capture(column) for key, column in self.buffer.items()}
+            arrays['priorities.npy'] = capture(self.priorities)
+            if self.sequential_storage:
+                arrays['episode_boundaries.npy'] = capture(self.episode_boundaries)
+                boundary_ids = sorted(self.boundary_next_states.keys())
+                arrays['boundary_ids.npy'] = array(boundary_ids, dtype='int64')
+                if boundary_ids:
+                    arrays['boundary_next_states.npy'] = stack([self.boundary_next_states[boundary_id]
+                                                                for boundary_id in boundary_ids])
+            if self.state_interning:
+                arrays['state_table.npy'] = capture(self.state_table[:self.state_table_size])
+                arrays['state_reference_counts.npy'] = capture(self.state_reference_counts[:self.state_table_size])
+
+            metadata = {
+                'buffer_size': self.buffer_size,
+                'write_pointer': self.write_pointer,
+                'max_priority': float(self.max_priority),
+                'compact_storage': self.compact_storage,
+                'sequential_storage': self.sequential_storage,
+                'state_interning': self.state_interning,
+                'eviction_policy_name': self.eviction_policy_name,
+                'eviction_policy_state': deepcopy(self.eviction_policy.get_state()),
+                'columns': list(self.buffer.keys()),
+            }
+
+        return {'arrays': arrays, 'metadata': metadata}
+
+    @staticmethod
+    def write_snapshot(
+            snapshot: dict,  # from get_snapshot
+            buffer_path: Path,
+    ) -> None:
+
+        temporary_path = Path(buffer_path.parent, f'{buffer_path.name}_tmp')
+        rmtree(temporary_path, ignore_errors=True)
+        temporary_path.mkdir(parents=True)
+
+        for file_name, values in snapshot['arrays'].items():
+            np_save(Path(temporary_path, file_name), values)
+        with open(Path(temporary_path, 'metadata.json'), 'w') as file:
+            json_dump(snapshot['metadata'], file, indent=4)
+
+        rmtree(buffer_path, ignore_errors=True)
+        temporary_path.rename(buffer_path)
+
+    def load(
+            self,
+            buffer_path: Path,
+    ) -> None:
+        """
+        Restore a buffer written by save. Columns are memory-mapped copy-on-write, so loading is fast
+        regardless of buffer size and the files on disk are never modified by training.
+        """
+
+        with open(Path(buffer_path, 'metadata.json'), 'r') as file:
+            metadata = json_load(file)
+
+        for setting in ['buffer_size', 'compact_storage', 'sequential_storage', 'state_interning',
+                        'eviction_policy_name']:
+            if metadata[setting] != getattr(self, setting):
+                raise ValueError(f'Saved buffer has {setting}={metadata[setting]}, '
+                                 f'this buffer has {setting}={getattr(self, setting)}')
+
+        self.buffer = {
+            key: np_load(Path(buffer_path, f'{key}.npy'), mmap_mode='c')
+            for key in metadata['columns']
+        }
+        self.priorities = np_load(Path(buffer_path, 'priorities.npy'))
+        self.write_pointer = metadata['write_pointer']
+        self.max_priority = metadata['max_priority']
+        self.eviction_policy.set_state(metadata['eviction_policy_state'])
+
+        if self.sequential_storage:
+            self.episode_boundaries = np_load(Path(buffer_path, 'episode_boundaries.npy'))
+            boundary_ids = np_load(Path(buffer_path, 'boundary_ids.npy'))
+            self.boundary_next_states = {}
+            if len(boundary_ids) > 0:
+                boundary_next_states = np_load(Path(buffer_path, 'boundary_next_states.npy'))
+                for boundary_id, next_state in zip(boundary_ids, boundary_next_states):
+                    self.boundary_next_states[int(boundary_id)] = next_state
+
+        if self.state_interning:
+            self.state_table = np_load(Path(buffer_path, 'state_table.npy'))
+            self.state_reference_counts = np_load(Path(buffer_path, 'state_reference_counts.npy'))
+            self.state_table_size = len(self.state_table)
+            self.state_ids = {}
+            self.free_state_ids = []
+            for state_id in range(self.state_table_size):
+                if self.state_reference_counts[state_id] > 0:
+                    self.state_ids[self.state_table[state_id].tobytes()] = state_id
+                else:
+                    self.free_state_ids.append(state_id)
@@ -0,0 +1,149 @@
+
+from json import (
+    dump as json_dump,
+    load as json_load,
+)
+from numpy import (
+    ndarray,
+    array,
+    arange,
+    argwhere,
+    zeros,
+    sqrt as np_sqrt,
+    prod as np_prod,
+    cumprod as np_cumprod,
+    dot as np_dot,
+    load as np_load,
+)
+from numpy.lib.format import (
+    open_memmap,
+)
+from pathlib import (
+    Path,
+)
+
+
+class LookupTablePolicy:
+    """
+    The sim state is discrete: per user a power gain from power_gains, a job size from 0 to the max job size
+    of the user type, and a priority that is set exactly for prioritized users with a job. This policy stores
+    the action for every state in a table, indexed by the state's digits in a mixed radix, so acting is a
+    single memory-mapped table lookup instead of a network forward pass.
+    """
+
+    power_gains: list = [1, 4, 9, 16]  # squared integer fading 1..4, see _User.update_power_gain
+
+    def __init__(
+            self,
+            max_job_sizes: list,  # per user
+            priority_users: list,  # per user, whether jobs of the user are prioritized
+    ) -> None:
+
+        self.max_job_sizes: list = [int(max_job_size) for max_job_size in max_job_sizes]
+        self.priority_users: list = [bool(priority_user) for priority_user in priority_users]
+        self.num_users: int = len(self.max_job_sizes)
+
+        # digits ordered like the state vector: power gain indices of all users, then job sizes of all users
+        self.radices: ndarray = array([len(self.power_gains)] * self.num_users
+                                      + [max_job_size + 1 for max_job_size in self.max_job_sizes])
+        self.strides: ndarray = array([*np_cumprod(self.radices[::-1])[::-1][1:], 1])
+        self.num_states: int = int(np_prod(self.radices))
+
+        self.table: ndarray | None = None  # [num_states, num_actions]
+
+    @classmethod
+    def from_sim(
+            cls,
+            sim,  # SchedulingData
+    ) -> 'LookupTablePolicy':
+        return cls(
+            max_job_sizes=[user.max_job_size_resource_slots for user in sim.users.values()],
+            priority_users=[user.job_prio for user in sim.users.values()],
+        )
+
+    def get_state_indices(
+            self,
+            states: ndarray,  # [batch, 3 * num_users]
+    ) -> ndarray:
+        digits = states[:, :2 * self.num_users].astype('float32')
+        digits[:, :self.num_users] = np_sqrt(digits[:, :self.num_users]) - 1  # power gain to power gain index
+        digits = digits.round().astype('int64')
+
+        # an out of range digit would carry into its neighbour and silently index another state
+        out_of_range = (digits < 0) | (digits >= self.radices)
+        if out_of_range.any():
+            state_id, component_id = argwhere(out_of_range)[0]
+            raise ValueError(f'state {state_id} component {component_id} is {states[state_id, component_id]}, '
+                             f'outside the {self.radices[component_id]} values the table covers')
+
+        return np_dot(digits, self.strides)
+
+    def get_states(
+            self,
+            state_indices: ndarray,
+    ) -> ndarray:
+        digits = (state_indices[:, None] // self.strides) % self.radices
+
+        states = zeros((len(state_indices), 3 * self.num_users), dtype='float32')
+        states[:, :self.num_users] = array(self.power_gains, dtype='float32')[digits[:, :self.num_users]]
+        states[:, self.num_users:2 * self.num_users] = digits[:, self.num_users:]
+        states[:, 2 * self.num_users:] = (digits[:, self.num_users:] > 0) & array(self.priority_users)
+
+        return states
+
+    def build_table(
+            self,
+            policy,  # any policy with a batched call(states), e.g., NumpyPolicy
+            table_path: Path,  # .npy
+            batch_size: int = 16_384,
+    ) -> None:
+        """
+        Evaluate policy on every state in batches and write the actions to a memory-mapped .npy file,
+        with the state space layout in a .json file next to it.
+        """
+
+        for batch_start in range(0, self.num_states, batch_size):
+            state_indices = arange(batch_start, min(batch_start + batch_size, self.num_states))
+            actions = policy.call(self.get_states(state_indices))
+            if batch_start == 0:
+                Path(table_path).parent.mkdir(parents=True, exist_ok=True)
+                self.table = open_memmap(table_path, mode='w+', dtype='float32',
+                                         shape=(self.num_states, actions.shape[1]))
+            self.table[state_indices] = actions
+        self.table.flush()
+
+        with open(Path(table_path).with_suffix('.json'), 'w') as file:
+            json_dump({'power_gains': self.power_gains,
+                       'max_job_sizes': self.max_job_sizes,
+                       'priority_users': self.priority_users}, file)
+
+        self.table = np_load(table_path, mmap_mode='r')
+
+    @classmethod
+    def load(
+            cls,
+            table_path: Path,
+    ) -> 'LookupTablePolicy':
+        with open(Path(table_path).with_suffix('.json'), 'r') as file:
+            state_space = json_load(file)
+        if state_space['power_gains'] != cls.power_gains:
+            raise ValueError(f'table built for power gains {state_space["power_gains"]}, expected {cls.power_gains}')
+
+        lookup_table_policy = cls(max_job_sizes=state_space['max_job_sizes'],
+                                  priority_users=state_space['priority_users'])
+        lookup_table_policy.table = np_load(table_path, mmap_mode='r')
+
+        return lookup_table_policy
+
+    def get_action(
+            self,
+            state: ndarray,  # [3 * num_users]
+    ) -> ndarray:
+        return array(self.table[self.get_state_indices(state[None])[0]])
+
+    def call(
+            self,
+            states: ndarray,  # [batch, 3 * num_users]
+    ) -> ndarray:
+        return self.table[self.get_state_indices(states)]
+
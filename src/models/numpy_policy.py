@@ -0,0 +1,203 @@
+
+from numpy import (
+    ndarray,
+    array as np_array,
+    empty as np_empty,
+    dot as np_dot,
+    add as np_add,
+    tanh as np_tanh,
+    maximum as np_maximum,
+    less as np_less,
+    multiply as np_multiply,
+    exp as np_exp,
+    subtract as np_subtract,
+    divide as np_divide,
+    max as np_max,
+    sum as np_sum,
+    abs as np_abs,
+)
+
+
+def activation_linear(
+        x: ndarray,
+        mask: ndarray,
+) -> None:
+    pass
+
+
+def activation_tanh(
+        x: ndarray,
+        mask: ndarray,
+) -> None:
+    np_tanh(x, out=x)
+
+
+def activation_relu(
+        x: ndarray,
+        mask: ndarray,
+) -> None:
+    np_maximum(x, 0, out=x)
+
+
+def activation_penalized_tanh(
+        x: ndarray,
+        mask: ndarray,
+) -> None:
+    # tanh keeps the sign, so the mask can be taken after the tanh
+    np_tanh(x, out=x)
+    np_less(x, 0, out=mask)
+    np_multiply(x, .25, out=x, where=mask)
+
+
+def activation_softmax(
+        x: ndarray,
+        mask: ndarray,
+) -> None:
+    np_subtract(x, np_max(x, axis=-1, keepdims=True), out=x)
+    np_exp(x, out=x)
+    np_divide(x, np_sum(x, axis=-1, keepdims=True), out=x)
+
+
+# by the __name__ of the keras activation function
+numpy_activations: dict = {
+    'linear': activation_linear,
+    'tanh': activation_tanh,
+    'relu': activation_relu,
+    'activation_penalized_tanh': activation_penalized_tanh,
+    'softmax': activation_softmax,
+}
+
+
+class NumpyPolicy:
+    """
+    Forward pass of a policy MLP in numpy, for acting on single states without tensorflow dispatch overhead.
+    The weights are copied from the Dense layers of a PolicyNetwork or a PolicyNetwork loaded from SavedModel,
+    all intermediate results are written into preallocated float32 buffers.
+    """
+
+    def __init__(
+            self,
+            kernels: list,  # per layer [units_in, units_out]
+            biases: list,  # per layer [units_out]
+            activation_names: list,  # per layer, see numpy_activations
+    ) -> None:
+
+        for activation_name in activation_names:
+            if activation_name not in numpy_activations:
+                raise ValueError(f'activation {activation_name} has no numpy implementation')
+
+        self.kernels: list = [np_array(kernel, dtype='float32') for kernel in kernels]
+        self.biases: list = [np_array(bias, dtype='float32') for bias in biases]
+        self.activation_names: list = activation_names
+        self.activations: list = [numpy_activations[activation_name] for activation_name in activation_names]
+
+        self.size_input: int = self.kernels[0].shape[0]
+
+        # Preallocated buffers for acting on one state
+        self.input_buffer: ndarray = np_empty(self.size_input, dtype='float32')
+        self.layer_buffers: list = [np_empty(kernel.shape[1], dtype='float32') for kernel in self.kernels]
+        self.mask_buffers: list = [np_empty(kernel.shape[1], dtype='bool') for kernel in self.kernels]
+
+    @classmethod
+    def from_keras(
+            cls,
+            network,  # PolicyNetwork, or PolicyNetwork loaded via keras load_model
+    ) -> 'NumpyPolicy':
+        kernels, biases, activation_names = cls._get_layer_weights(network)
+
+        return cls(kernels=kernels, biases=biases, activation_names=activation_names)
+
+    @staticmethod
+    def _get_layer_weights(
+            network,
+    ) -> tuple[list, list, list]:
+        layers = [*network.hidden_layers, network.output_layer]
+        kernels = [layer.kernel.numpy() for layer in layers]
+        biases = [layer.bias.numpy() for layer in layers]
+        activation_names = [layer.activation.__name__ for layer in layers]
+
+        return kernels, biases, activation_names
+
+    def set_weights_from_keras(
+            self,
+            network,
+    ) -> None:
+        """
+        Copy the current weights of network into the existing kernels, e.g., to follow a policy in training.
+        """
+
+        kernels, biases, _ = self._get_layer_weights(network)
+        self.set_weights(kernels=kernels, biases=biases)
+
+    def set_weights(
+            self,
+            kernels: list,
+            biases: list,
+    ) -> None:
+        """
+        Copy weights into the existing kernels, e.g., weights sent from another process.
+        """
+
+        for kernel_target, bias_target, kernel, bias in zip(self.kernels, self.biases, kernels, biases):
+            kernel_target[:] = kernel
+            bias_target[:] = bias
+
+    def get_action(
+            self,
+            state: ndarray,  # [size_input]
+    ) -> ndarray:
+        """
+        Action for one state, allocation free apart from the returned copy.
+        """
+
+        self.input_buffer[:] = state
+        x = self.input_buffer
+        for kernel, bias, activation, layer_buffer, mask_buffer in zip(
+                self.kernels, self.biases, self.activations, self.layer_buffers, self.mask_buffers):
+            np_dot(x, kernel, out=layer_buffer)
+            np_add(layer_buffer, bias, out=layer_buffer)
+            activation(layer_buffer, mask_buffer)
+            x = layer_buffer
+
+        return x.copy()
+
+    def call(
+            self,
+            states: ndarray,  # [batch, size_input]
+    ) -> ndarray:
+        """
+        Actions for a batch of states. Allocates its intermediate results.
+        """
+
+        x = np_array(states, dtype='float32')
+        for kernel, bias, activation in zip(self.kernels, self.biases, self.activations):
+            x = np_dot(x, kernel)
+            np_add(x, bias, out=x)
+            activation(x, np_empty(x.shape, dtype='bool'))
+
+        return x
+
+    def verify(
+            self,
+            network,
+            states: ndarray,  # [batch, size_input]
+            tolerance: float = 1e-5,  # absolute, on allocation shares in [0, 1]
+    ) -> float:
+        """
+        Compare the actions of call and get_action against the keras network. Returns the max absolute
+        deviation, raises ValueError if it exceeds tolerance. This is the one parity check of the numpy path,
+        run wherever a saved policy is loaded into a NumpyPolicy. Both paths compute in float32 but accumulate
+        in a different order, their shares differ by less than 1e-6. The default tolerance leaves room for that
+        and is still far below the 1 / num_total_resource_slots share of a single resource slot.
+        """
+
+        actions_keras = network.call(np_array(states, dtype='float32')).numpy()
+        max_deviation = max(
+            float(np_max(np_abs(self.call(states) - actions_keras))),
+            max(float(np_max(np_abs(self.get_action(state) - action_keras)))
+                for state, action_keras in zip(states, actions_keras)),
+        )
+        if max_deviation > tolerance:
+            raise ValueError(f'numpy policy deviates from keras policy by {max_deviation:.2e} > {tolerance:.2e}')
+
+        return max_deviation
@@ -0,0 +1,114 @@
+
+from json import (
+    dump as json_dump,
+    load as json_load,
+)
+from pathlib import (
+    Path,
+)
+from shutil import (
+    copytree,
+    rmtree,
+)
+from numpy import (
+    zeros,
+    savez as np_savez,
+    load as np_load,
+)
+from keras.models import (
+    load_model,
+)
+
+from src.models.dqn import (
+    PolicyNetwork,
+    PolicyNetworkSoft,
+)
+
+policy_network_classes: dict = {
+    'PolicyNetwork': PolicyNetwork,
+    'PolicyNetworkSoft': PolicyNetworkSoft,
+}
+
+
+def write_policy_snapshot(
+        snapshot_path: Path,
+        weights: list,  # network.get_weights()
+        network_class_name: str,  # see policy_network_classes
+        network_args: dict,  # constructor args of the network
+        config_path: Path,  # copied into the snapshot
+) -> None:
+    """
+    Weights-only snapshot of a policy network: the weights as .npz, the network layout as .json and a copy of
+    the config. Files are first written to a temporary folder, so an interrupted write leaves no partial snapshot.
+    """
+
+    temporary_path = Path(snapshot_path.parent, f'{snapshot_path.name}_tmp')
+    rmtree(temporary_path, ignore_errors=True)
+    temporary_path.mkdir(parents=True)
+
+    np_savez(Path(temporary_path, 'policy_weights.npz'),
+             **{f'weights_{weights_id}': values for weights_id, values in enumerate(weights)})
+    with open(Path(temporary_path, 'policy_network.json'), 'w') as file:
+        json_dump({
+            'network_class_name': network_class_name,
+            'network_args': network_args,
+            'size_input': int(weights[0].shape[0]),
+            'num_weights': len(weights),
+        }, file, indent=4)
+    copytree(config_path, Path(temporary_path, 'config'))
+
+    rmtree(snapshot_path, ignore_errors=True)
+    temporary_path.rename(snapshot_path)
+
+
+def is_policy_snapshot(
+        snapshot_path: Path,
+) -> bool:
+    return Path(snapshot_path, 'policy_weights.npz').is_file()
+
+
+def load_policy_snapshot(
+        snapshot_path: Path,
+):  # -> PolicyNetwork or PolicyNetworkSoft
+    """
+    Rebuild the network of a snapshot written by write_policy_snapshot and restore its weights.
+    """
+
+    with open(Path(snapshot_path, 'policy_network.json'), 'r') as file:
+        layout = json_load(file)
+
+    network = policy_network_classes[layout['network_class_name']](**layout['network_args'])
+    network.initialize_inputs(zeros((1, layout['size_input']), dtype='float32'))
+    network.set_weights(load_policy_weights(snapshot_path))
+
+    return network
+
+
+def load_policy_weights(
+        policy_path: Path,  # policy snapshot, or SavedModel policy
+) -> list:
+    """
+    Policy weights in the order of network.get_weights(), read from the weights file of a policy snapshot.
+    Policies saved as SavedModel only are loaded in full to read their weights, which is much slower.
+    """
+
+    if not is_policy_snapshot(policy_path):
+        return load_model(policy_path).get_weights()
+
+    with open(Path(policy_path, 'policy_network.json'), 'r') as file:
+        num_weights = json_load(file)['num_weights']
+    with np_load(Path(policy_path, 'policy_weights.npz')) as weights:
+        return [weights[f'weights_{weights_id}'] for weights_id in range(num_weights)]
+
+
+def load_policy_network(
+        policy_path: Path,  # policy snapshot, or SavedModel policy
+):  # -> PolicyNetwork or PolicyNetworkSoft, or the network loaded via keras load_model
+    """
+    Load a policy network from its snapshot where there is one, otherwise from its SavedModel.
+    """
+
+    if is_policy_snapshot(policy_path):
+        return load_policy_snapshot(policy_path)
+
+    return load_model(policy_path)
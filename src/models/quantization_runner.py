@@ -0,0 +1,98 @@
+
+from numpy import (
+    newaxis,
+)
+from pathlib import (
+    Path,
+)
+
+from src.config.config import (
+    Config,
+)
+from src.models.policy_snapshot import (
+    load_policy_network,
+)
+from src.models.numpy_policy import (
+    NumpyPolicy,
+)
+from src.models.quantized_policy import (
+    QuantizedPolicy,
+)
+from src.models.distillation_runner import (
+    get_directory_size_bytes,
+    collect_states,
+    evaluate_reward_parity,
+)
+from src.utils.measure_latency_us import (
+    measure_latency_us,
+)
+
+
+class QuantizationRunner:
+    """
+    Quantize a trained policy to int8 and compare its allocations, rewards and latency against the float policy.
+    """
+
+    def __init__(
+            self,
+            config: Config | None = None,  # by default a fresh Config
+    ) -> None:
+
+        self.config = config if config is not None else Config()
+        self.rng = self.config.rng
+
+    def quantize(
+            self,
+            policy_path: Path,  # saved PolicyNetwork
+            quantized_name: str,
+    ) -> dict:
+
+        quantization_args = self.config.quantization_args
+
+        network = load_policy_network(policy_path)
+        float_policy = NumpyPolicy.from_keras(network)
+
+        # CALIBRATE & CONVERT
+        calibration_states = collect_states(config=self.config,
+                                            policy=float_policy,
+                                            num_states=quantization_args['num_calibration_states'],
+                                            exploration_noise_momentum=quantization_args['exploration_noise_momentum'])
+        float_policy.verify(network=network, states=calibration_states[:100])
+        quantized_policy = QuantizedPolicy.from_keras(network=network, calibration_states=calibration_states)
+
+        quantized_path = Path(self.config.models_path, quantized_name, 'policy.tflite')
+        quantized_policy.save(quantized_path)
+
+        for tensor_name, shape, num_scales in quantized_policy.get_weight_quantization():
+            self.config.logger.info(f'int8 weights {tensor_name} {shape}: {num_scales} scales')
+
+        # REPORT
+        report = evaluate_reward_parity(config=self.config,
+                                        reference_policy=float_policy,
+                                        candidate_policy=quantized_policy,
+                                        num_evaluation_steps=quantization_args['num_evaluation_steps'])
+        evaluation_states = report.pop('states')
+
+        report['latency_us_keras_float'] = measure_latency_us(
+            lambda state: network.call(state[newaxis]).numpy().squeeze(), evaluation_states)
+        report['latency_us_numpy_float'] = measure_latency_us(float_policy.get_action, evaluation_states)
+        report['latency_us_int8'] = measure_latency_us(quantized_policy.get_action, evaluation_states)
+        report['saved_size_bytes_float'] = get_directory_size_bytes(Path(policy_path))
+        report['saved_size_bytes_int8'] = quantized_path.stat().st_size
+
+        for key, value in report.items():
+            self.config.logger.info(f'{key}: {value:.4g}')
+
+        return report
+
+
+if __name__ == '__main__':
+
+    from src.config.config_gui import (
+        ConfigGUI,
+    )
+
+    # Quantize the learned agents of the GUI
+    r = QuantizationRunner()
+    for agent_path in ConfigGUI.learned_agent_paths.values():
+        r.quantize(policy_path=Path(r.config.models_path, agent_path), quantized_name=f'{agent_path.parts[0]}_int8')
@@ -0,0 +1,99 @@
+
+from numpy import (
+    ndarray,
+    empty as np_empty,
+)
+from pathlib import (
+    Path,
+)
+from tensorflow import (
+    function as tf_function,
+    TensorSpec as tf_TensorSpec,
+    float32 as tf_float32,
+    lite as tf_lite,
+)
+
+
+class QuantizedPolicy:
+    """
+    int8 post-training quantized policy, run by the tflite interpreter. Weights are quantized per output
+    channel, activations per tensor with ranges calibrated on representative states. Inputs and outputs
+    stay float32, everything in between runs on int8 kernels.
+    """
+
+    def __init__(
+            self,
+            model_content: bytes,  # tflite flatbuffer
+    ) -> None:
+
+        self.model_content: bytes = model_content
+
+        self.interpreter = tf_lite.Interpreter(model_content=model_content)
+        self.interpreter.allocate_tensors()
+        input_details = self.interpreter.get_input_details()[0]
+        self.input_index: int = input_details['index']
+        self.output_index: int = self.interpreter.get_output_details()[0]['index']
+
+        self.size_input: int = int(input_details['shape'][1])
+        self.input_buffer: ndarray = np_empty((1, self.size_input), dtype='float32')
+
+    @classmethod
+    def from_keras(
+            cls,
+            network,  # PolicyNetwork, or PolicyNetwork loaded via keras load_model
+            calibration_states: ndarray,  # [num_states, size_input], calibrate the activation ranges
+    ) -> 'QuantizedPolicy':
+
+        size_input = calibration_states.shape[1]
+        concrete_function = tf_function(lambda states: network.call(states)).get_concrete_function(
+            tf_TensorSpec(shape=[1, size_input], dtype=tf_float32))
+
+        def representative_dataset():
+            for state in calibration_states:
+                yield [state.reshape(1, size_input).astype('float32')]
+
+        converter = tf_lite.TFLiteConverter.from_concrete_functions([concrete_function], network)
+        converter.optimizations = [tf_lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+
+        return cls(model_content=converter.convert())
+
+    @classmethod
+    def load(
+            cls,
+            model_path: Path,
+    ) -> 'QuantizedPolicy':
+        return cls(model_content=Path(model_path).read_bytes())
+
+    def save(
+            self,
+            model_path: Path,
+    ) -> None:
+        Path(model_path).parent.mkdir(parents=True, exist_ok=True)
+        Path(model_path).write_bytes(self.model_content)
+
+    def get_action(
+            self,
+            state: ndarray,  # [size_input]
+    ) -> ndarray:
+
+        self.input_buffer[0] = state
+        self.interpreter.set_tensor(self.input_index, self.input_buffer)
+        self.interpreter.invoke()
+
+        return self.interpreter.get_tensor(self.output_index)[0]
+
+    def get_weight_quantization(
+            self,
+    ) -> list:
+        """
+        Shape and num of quantization scales of every int8 weight tensor, one scale per output channel.
+        """
+
+        return [
+            (tensor_details['name'], tuple(tensor_details['shape']),
+             len(tensor_details['quantization_parameters']['scales']))
+            for tensor_details in self.interpreter.get_tensor_details()
+            if tensor_details['dtype'].__name__ == 'int8' and len(tensor_details['shape']) == 2
+            and tensor_details['shape'][0] != 1  # activations have batch size 1
+        ]
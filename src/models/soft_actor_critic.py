@@ -15,24 +15,34 @@ from tensorflow import (
     Variable as tf_Variable,
     float32 as tf_float32,
     function as tf_function,
-)
-from keras.models import (
-    load_model,
+    constant as tf_constant,
+    concat as tf_concat,
+    squeeze as tf_squeeze,
+    exp as tf_exp,
+    reduce_min as tf_reduce_min,
+    reduce_sum as tf_reduce_sum,
+    reduce_mean as tf_reduce_mean,
+    stop_gradient as tf_stop_gradient,
+    GradientTape as tf_GradientTape,
+    TensorSpec as tf_TensorSpec,
 )
 from pathlib import (
     Path,
 )
 
+from src.models.actor_critic_base import (
+    ActorCriticBase,
+)
 from src.models.experience_buffer import (
     ExperienceBuffer,
 )
 from src.models.dqn import (
-    ValueNetwork,
+    ValueNetworkEnsemble,
     PolicyNetworkSoft,
 )
 
 
-class SoftActorCritic:
+class SoftActorCritic(ActorCriticBase):
     def __init__(
             self,
             rng: default_rng,
@@ -45,11 +55,18 @@ class SoftActorCritic:
             training_minimum_experiences: int,
             training_batch_size: int,
             training_target_update_momentum_tau: float,
+            training_prefetch_batches: int,
+            training_jit_compile: bool,
+            training_update_to_data_ratio: float,
+            training_updates_per_call: int,
             experience_buffer_args: dict,
             network_args: dict,
+            experience_buffer: ExperienceBuffer | None = None,  # share an existing buffer instead
+            reward_weightings: ndarray | None = None,  # train on rewards relabeled from reward components
     ) -> None:
 
         def initialize_networks(
+            num_value_networks: int,
             value_network_args: dict,
             value_network_optimizer: callable,
             value_network_optimizer_args: dict,
@@ -61,30 +78,49 @@ class SoftActorCritic:
         ) -> None:
 
             # CREATE NETWORKS
-            #  Create target and primary value networks and policy network
-            for value_network_id in range(2):
-                self.value_networks[value_network_id] = {name: ValueNetwork(**value_network_args)
-                                                         for name in ['primary', 'target']}
-            self.policy_network = PolicyNetworkSoft(num_actions=num_actions, **policy_network_args)
+            #  Create target and primary value network ensembles and policy network.
+            #  The soft policy is stochastic and needs no target network.
+            self.networks['value'].append(
+                {
+                    'primary': ValueNetworkEnsemble(num_networks=num_value_networks, **value_network_args),
+                    'target': ValueNetworkEnsemble(num_networks=num_value_networks, **value_network_args),
+                }
+            )
+            self.networks['policy'].append(
+                {
+                    'primary': PolicyNetworkSoft(num_actions=num_actions, **policy_network_args),
+                }
+            )
 
             # INITIALIZE NETWORKS
             #  Assign optimizer, initialize primary weights, and copy weights to target networks
             dummy_state = self.rng.random(size_state)
             dummy_action = self.rng.random(num_actions)
-            for network_id in self.value_networks:
-                self.value_networks[network_id]['primary'].compile(
+            for network_pair in self.networks['value']:
+                network_pair['primary'].compile(
                     optimizer=value_network_optimizer(**value_network_optimizer_args))
-                for network in self.value_networks[network_id].values():
-                    network(np_concatenate([dummy_state, dummy_action])[np_newaxis])
-            self.policy_network.compile(
-                optimizer=policy_network_optimizer(**policy_network_optimizer_args))
-            self.policy_network(dummy_state[np_newaxis])
-            self.update_target_networks(tau_target_update=1.0)
+                for network in network_pair.values():
+                    network.initialize_inputs(np_concatenate([dummy_state, dummy_action])[np_newaxis])
+            for network_pair in self.networks['policy']:
+                network_pair['primary'].compile(
+                    optimizer=policy_network_optimizer(**policy_network_optimizer_args))
+                network_pair['primary'].initialize_inputs(dummy_state[np_newaxis])
+            self.update_target_networks(tau_target_update=tf_constant(1.0))
 
-        self.rng = rng
-        self.logger = parent_logger.getChild(__name__)
-
-        self.future_reward_discount_gamma = future_reward_discount_gamma
+        super().__init__(
+            rng=rng,
+            parent_logger=parent_logger,
+            future_reward_discount_gamma=future_reward_discount_gamma,
+            training_minimum_experiences=training_minimum_experiences,
+            training_batch_size=training_batch_size,
+            training_target_update_momentum_tau=training_target_update_momentum_tau,
+            training_prefetch_batches=training_prefetch_batches,
+            training_update_to_data_ratio=training_update_to_data_ratio,
+            training_updates_per_call=training_updates_per_call,
+            experience_buffer_args=experience_buffer_args,
+            experience_buffer=experience_buffer,
+            reward_weightings=reward_weightings,
+        )
 
         # Gradients are applied on the log value. This way, entropy_scale_alpha is restricted to positive range
         self.log_entropy_scale_alpha = tf_Variable(np_log(entropy_scale_alpha_initial),
@@ -92,53 +128,169 @@ class SoftActorCritic:
         self.target_entropy = target_entropy
         self.entropy_scale_alpha_optimizer = entropy_scale_optimizer(**entropy_scale_optimizer_args)
 
-        self.training_minimum_experiences = training_minimum_experiences
-        self.training_batch_size = training_batch_size
-        self.training_target_update_momentum_tau = training_target_update_momentum_tau
-
-        self.experience_buffer = ExperienceBuffer(**experience_buffer_args)
-
-        self.value_networks: dict = {}
-        self.policy_network = None
+        self.networks: dict = {'value': [], 'policy': []}
         initialize_networks(**network_args)
 
+        self.build_train_graphs(size_state=network_args['size_state'], num_actions=network_args['num_actions'],
+                                jit_compile=training_jit_compile)
+
         self.logger.info('SoftActorCritic initialized')
 
     def save_networks(
             self,
             model_path: Path,
     ) -> None:
-        self.value_networks[0]['target'].save(Path(model_path, 'value1'))
-        self.value_networks[1]['target'].save(Path(model_path, 'value2'))
-        self.policy_network.save(Path(model_path, 'policy'))
+        for network_pair_id, network_pair in enumerate(self.networks['value']):
+            network_pair['target'].save(Path(model_path, f'value_{network_pair_id}'))
+        self.networks['policy'][0]['primary'].save(Path(model_path, 'policy'))
 
-    def load_policy(
+    def get_training_state(
             self,
-            model_path: Path,
+    ) -> dict:
+        """
+        Extends the training state by the entropy scale and its optimizer slots.
+        """
+
+        training_state = super().get_training_state()
+        training_state['arrays']['log_entropy_scale_alpha'] = [self.log_entropy_scale_alpha.numpy()]
+        training_state['arrays']['entropy_scale_alpha_optimizer'] = [
+            variable.numpy() for variable in self.entropy_scale_alpha_optimizer.variables]
+
+        return training_state
+
+    def set_training_state(
+            self,
+            training_state: dict,  # from get_training_state
     ) -> None:
-        self.policy_network = load_model(Path(model_path, 'policy'))
+
+        super().set_training_state(training_state)
+
+        arrays = training_state['arrays']
+        self.log_entropy_scale_alpha.assign(arrays['log_entropy_scale_alpha'][0])
+        self.entropy_scale_alpha_optimizer.build([self.log_entropy_scale_alpha])
+        for variable, value in zip(self.entropy_scale_alpha_optimizer.variables,
+                                   arrays['entropy_scale_alpha_optimizer']):
+            variable.assign(value)
 
     def get_action(
             self,
             state,
     ) -> ndarray:
-        _, _, actions_softmax = self.policy_network.get_action_and_log_prob_density(state=state)
+        if state.ndim == 1:
+            state = state[np_newaxis]
+        _, _, actions_softmax = self.networks['policy'][0]['primary'].get_action_and_log_prob_density(state=state)
 
         return actions_softmax.numpy().flatten()
 
-    def add_experience(
+    def get_graph_functions(
             self,
-            experience: dict,
-    ) -> None:
-        self.experience_buffer.add_experience(experience=experience)
+    ) -> dict:
+        """
+        All traced functions of this allocator by name, e.g., to monitor retracing.
+        """
+
+        graph_functions = {
+            'train_graph': self.train_graph,
+            'train_many_graph': self.train_many_graph,
+            'update_target_networks': self.update_target_networks,
+        }
+        for network_type, network_list in self.networks.items():
+            for network_pair_id, network_pair in enumerate(network_list):
+                for network_rank, network in network_pair.items():
+                    graph_functions[f'{network_type}_{network_pair_id}_{network_rank}.call'] = network.call
+        graph_functions['policy_0_primary.get_action_and_log_prob_density'] = (
+            self.networks['policy'][0]['primary'].get_action_and_log_prob_density
+        )
 
-    @tf_function
+        return graph_functions
+
+    @tf_function(input_signature=[tf_TensorSpec(shape=[], dtype=tf_float32)])
     def update_target_networks(
             self,
-            tau_target_update: float
+            tau_target_update,  # float32 scalar tensor, python floats are converted by the signature
     ) -> None:
         # Value networks
-        for network_id in self.value_networks:
-            for v_primary, v_target in zip(self.value_networks[network_id]['primary'].trainable_variables,
-                                           self.value_networks[network_id]['target'].trainable_variables):
+        for network_pair in self.networks['value']:
+            for v_primary, v_target in zip(network_pair['primary'].trainable_variables,
+                                           network_pair['target'].trainable_variables):
                 v_target.assign(tau_target_update * v_primary + (1 - tau_target_update) * v_target)
+
+    def train_step(
+            self,
+            states,
+            actions,
+            rewards,
+            next_states,
+            sample_importance_weights,
+    ):
+        policy_network = self.networks['policy'][0]['primary']
+        entropy_scale_alpha = tf_exp(self.log_entropy_scale_alpha)
+
+        # TRAIN VALUE NETWORKS
+        target_q = rewards
+        # get soft future reward estimate
+        if self.future_reward_discount_gamma > 0:
+            (
+                _,
+                next_action_log_prob_densities,
+                next_actions_softmax,
+            ) = policy_network.get_action_and_log_prob_density(next_states)
+            # action dimensions are sampled independently, their joint log density is the sum
+            next_action_log_probs = tf_reduce_sum(next_action_log_prob_densities, axis=1)
+            input_vector = tf_concat([next_states, next_actions_softmax], axis=1)
+            q_estimates = self.networks['value'][0]['target'].call(input_vector)  # [num_value_networks, batch, 1]
+            conservative_q_estimate = tf_squeeze(tf_reduce_min(q_estimates, axis=0), axis=-1)
+            target_q = target_q + self.future_reward_discount_gamma * (
+                conservative_q_estimate - entropy_scale_alpha * next_action_log_probs
+            )
+
+        input_vector = tf_concat([states, actions], axis=1)
+        for network_pair in self.networks['value']:
+            with tf_GradientTape() as tape:  # autograd
+                estimates = tf_squeeze(network_pair['primary'].call(input_vector), axis=-1)
+                td_errors = target_q - estimates  # [num_value_networks, batch]
+                # each member only depends on its own loss, summing them trains all members at once
+                loss = tf_reduce_sum(
+                    tf_reduce_mean(sample_importance_weights * td_errors ** 2, axis=1)
+                )
+
+            gradients = tape.gradient(target=loss,  # d_loss / d_parameters
+                                      sources=network_pair['primary'].trainable_variables)
+            network_pair['primary'].optimizer.apply_gradients(  # apply gradient update
+                zip(gradients, network_pair['primary'].trainable_variables))
+
+        # TRAIN POLICY NETWORK
+        with tf_GradientTape() as tape:  # autograd
+            (
+                _,
+                action_log_prob_densities,
+                actions_softmax,
+            ) = policy_network.get_action_and_log_prob_density(states)
+            action_log_probs = tf_reduce_sum(action_log_prob_densities, axis=1)
+            value_network_input = tf_concat([states, actions_softmax], axis=1)
+            # Both value estimates are computed in one ensemble pass, the conservative min is maximized
+            value_network_score = tf_squeeze(
+                tf_reduce_min(self.networks['value'][0]['primary'].call(value_network_input), axis=0), axis=-1
+            )
+            loss = tf_reduce_mean(
+                entropy_scale_alpha * action_log_probs - value_network_score
+            )
+
+        gradients = tape.gradient(target=loss,  # d_loss / d_parameters
+                                  sources=policy_network.trainable_variables)
+        policy_network.optimizer.apply_gradients(  # apply gradient update
+            zip(gradients, policy_network.trainable_variables))
+
+        # TRAIN ENTROPY SCALE
+        #  Raise alpha when the policy entropy drops below the target entropy, lower it otherwise
+        with tf_GradientTape() as tape:  # autograd
+            loss = - tf_reduce_mean(
+                self.log_entropy_scale_alpha * tf_stop_gradient(action_log_probs + self.target_entropy)
+            )
+
+        gradients = tape.gradient(target=loss,  # d_loss / d_parameters
+                                  sources=[self.log_entropy_scale_alpha])
+        self.entropy_scale_alpha_optimizer.apply_gradients(  # apply gradient update
+            zip(gradients, [self.log_entropy_scale_alpha]))
+
+        self.update_target_networks(tau_target_update=tf_constant(self.training_target_update_momentum_tau))
@@ -0,0 +1,237 @@
+
+from numpy import (
+    mean,
+    sort,
+)
+from multiprocessing import (
+    get_context,
+)
+from concurrent.futures import (
+    ProcessPoolExecutor,
+)
+from queue import (
+    Empty,
+)
+from json import (
+    dump as json_dump,
+)
+from pathlib import (
+    Path,
+)
+
+import tensorflow as tf
+
+from src.config.config import (
+    Config,
+)
+from src.models.training_runner import (
+    TrainingRunner,
+)
+
+
+def apply_overrides(
+        target,  # Config or a dict inside it
+        overrides: dict,  # attribute or key -> value, nested dicts override nested entries
+) -> None:
+
+    for key, value in overrides.items():
+        current = target.get(key) if isinstance(target, dict) else getattr(target, key)
+        if isinstance(value, dict) and isinstance(current, dict):
+            apply_overrides(current, value)
+        elif isinstance(target, dict):
+            target[key] = value
+        else:
+            setattr(target, key, value)
+
+
+def run_trial(
+        config: Config,
+        trial_id: int,
+        overrides: dict,
+        seed: int,
+        training_name: str,
+        report_queue,  # Manager Queue, (trial_id, episode_id, reward_per_step) after every episode
+        decision_queue,  # Manager Queue, whether the trial continues after the reported episode
+) -> dict:
+    """
+    Entry point of a trial process. Trains with the overridden config and reports each episode's reward,
+    stopping when the sweep prunes the trial.
+    """
+
+    config.seed = seed
+    apply_overrides(config, overrides)
+    config._post_init()  # recompute the collected args from the overridden values
+    tf.random.set_seed(seed)
+
+    runner = TrainingRunner(config=config)
+    episode_rewards = []
+
+    def episode_callback(
+            episode_id: int,
+            reward_per_step: dict,  # objective name -> reward per step
+    ) -> bool:
+        episode_rewards.append(float(mean(list(reward_per_step.values()))))
+        report_queue.put((trial_id, episode_id, episode_rewards[-1]))
+
+        return not decision_queue.get()
+
+    runner.train(training_name=training_name, episode_callback=episode_callback, show_plot=False)
+
+    return {
+        'trial_id': trial_id,
+        'overrides': overrides,
+        'seed': seed,
+        'episode_rewards': episode_rewards,
+        'pruned': len(episode_rewards) < config.num_episodes,
+    }
+
+
+class SweepRunner:
+    """
+    Hyperparameter sweep over config overrides. Trials train in parallel processes, each with its own seed,
+    and stream their episode rewards back. Asynchronous successive halving (ASHA) prunes trials at rungs of
+    min_episodes_per_trial * eta ** k episodes: a trial continues only if its reward is among the best 1 / eta
+    of all rewards reported at that rung so far. Pruned trials free their process for the next trial.
+    """
+
+    def __init__(
+            self,
+            config: Config | None = None,  # by default a fresh Config
+    ) -> None:
+
+        self.config = config if config is not None else Config()
+        self.rng = self.config.rng
+
+    def sample_trial_overrides(
+            self,
+            search_space: dict,  # see config.sweep_args
+            num_trials: int,
+    ) -> list:
+        """
+        Random search, every trial draws each entry of the search space independently.
+        """
+
+        def sample(space: dict) -> dict:
+            return {
+                key: sample(candidates) if isinstance(candidates, dict)
+                else candidates[self.rng.integers(len(candidates))]
+                for key, candidates in space.items()
+            }
+
+        return [sample(search_space) for _ in range(num_trials)]
+
+    def get_rung_episodes(
+            self,
+    ) -> list:
+        """
+        Num of completed episodes at which the trials are compared.
+        """
+
+        sweep_args = self.config.sweep_args
+
+        rung_episodes = []
+        num_episodes = sweep_args['min_episodes_per_trial']
+        while num_episodes < self.config.num_episodes:
+            rung_episodes.append(num_episodes)
+            num_episodes *= sweep_args['reduction_factor_eta']
+
+        return rung_episodes
+
+    def is_promotable(
+            self,
+            reward: float,
+            rung_rewards: list,  # all rewards reported at the rung, including reward
+    ) -> bool:
+        """
+        Whether reward is among the best 1 / eta of the rung. The first trial at a rung is always promoted.
+        """
+
+        num_promotable = max(len(rung_rewards) // self.config.sweep_args['reduction_factor_eta'], 1)
+
+        return reward >= sort(rung_rewards)[::-1][num_promotable - 1]
+
+    def sweep(
+            self,
+            sweep_name: str,
+            trial_overrides: list | None = None,  # per trial config overrides, by default sampled from the config
+    ) -> list:
+        """
+        Run all trials and return their results, best first.
+        """
+
+        sweep_args = self.config.sweep_args
+        if trial_overrides is None:
+            trial_overrides = self.sample_trial_overrides(search_space=sweep_args['search_space'],
+                                                          num_trials=sweep_args['num_trials'])
+        rung_episodes = self.get_rung_episodes()
+        rung_rewards: dict = {num_episodes: [] for num_episodes in rung_episodes}
+
+        # spawn instead of fork, forking a process that already runs tensorflow threads is unsafe
+        context = get_context('spawn')
+        manager = context.Manager()
+        report_queue = manager.Queue()
+        decision_queues = [manager.Queue() for _ in trial_overrides]
+
+        results = []
+        with ProcessPoolExecutor(max_workers=sweep_args['num_workers'], mp_context=context) as executor:
+            futures = [
+                executor.submit(
+                    run_trial,
+                    config=self.config,
+                    trial_id=trial_id,
+                    overrides=overrides,
+                    seed=int(self.rng.integers(2**31)),
+                    training_name=str(Path(sweep_name, f'trial_{trial_id}')),
+                    report_queue=report_queue,
+                    decision_queue=decision_queues[trial_id],
+                )
+                for trial_id, overrides in enumerate(trial_overrides)
+            ]
+
+            while not all(future.done() for future in futures) or not report_queue.empty():
+                try:
+                    trial_id, episode_id, reward_per_step = report_queue.get(timeout=1.0)
+                except Empty:
+                    continue
+
+                promoted = True
+                num_episodes = episode_id + 1
+                if num_episodes in rung_rewards:
+                    rung_rewards[num_episodes].append(reward_per_step)
+                    promoted = self.is_promotable(reward=reward_per_step, rung_rewards=rung_rewards[num_episodes])
+                    self.config.logger.info(f'Trial {trial_id} at rung {num_episodes} episodes: '
+                                            f'reward {reward_per_step:.3f}, {"promoted" if promoted else "pruned"}')
+                decision_queues[trial_id].put(promoted)
+
+            for trial_id, future in enumerate(futures):
+                if future.exception() is not None:
+                    self.config.logger.error(f'Trial {trial_id} failed: {future.exception()!r}')
+                    continue
+                results.append(future.result())
+        manager.shutdown()
+
+        # trials that survived more rungs rank first, ties are broken by the reward of their last episode
+        results.sort(key=lambda result: (len(result['episode_rewards']),
+                                         result['episode_rewards'][-1] if result['episode_rewards'] else 0.0),
+                     reverse=True)
+
+        num_episodes_run = sum(len(result['episode_rewards']) for result in results)
+        self.config.logger.info(f'Sweep {sweep_name}: {num_episodes_run} of '
+                                f'{len(trial_overrides) * self.config.num_episodes} episodes run, '
+                                f'{sum(result["pruned"] for result in results)} of {len(results)} trials pruned')
+        for result in results[:5]:
+            self.config.logger.info(f'Trial {result["trial_id"]}: reward {result["episode_rewards"][-1]:.3f} '
+                                    f'after {len(result["episode_rewards"])} episodes, {result["overrides"]}')
+
+        results_path = Path(self.config.models_path, sweep_name, 'sweep_results.json')
+        results_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(results_path, 'w') as file:
+            json_dump(results, file, indent=2)
+
+        return results
+
+
+if __name__ == '__main__':
+
+    r = SweepRunner()
+    r.sweep(sweep_name='sweep')
@@ -3,9 +3,12 @@ from numpy import (
     ndarray,
     newaxis,
     concatenate,
+    ones,
+    broadcast_to,
 )
 from numpy.random import (
     default_rng,
+    Generator,
 )
 from tensorflow import (
     math as tf_math,
@@ -16,13 +19,12 @@ from tensorflow import (
     float32 as tf_float32,
     squeeze as tf_squeeze,
     concat as tf_concat,
-    minimum as tf_minimum,
+    reduce_min as tf_reduce_min,
+    reduce_sum as tf_reduce_sum,
     clip_by_value as tf_clip_by_value,
     reduce_mean as tf_reduce_mean,
     GradientTape as tf_GradientTape,
-)
-from keras.models import (
-    load_model,
+    TensorSpec as tf_TensorSpec,
 )
 from logging import (
     Logger,
@@ -31,16 +33,19 @@ from pathlib import (
     Path,
 )
 
+from src.models.actor_critic_base import (
+    ActorCriticBase,
+)
 from src.models.experience_buffer import (
     ExperienceBuffer,
 )
 from src.models.dqn import (
-    ValueNetwork,
+    ValueNetworkEnsemble,
     PolicyNetwork,
 )
 
 
-class TD3ActorCritic:
+class TD3ActorCritic(ActorCriticBase):
 
     def __init__(
             self,
@@ -50,11 +55,25 @@ class TD3ActorCritic:
             training_minimum_experiences: int,
             training_batch_size: int,
             training_target_update_momentum_tau: float,
+            training_prefetch_batches: int,
+            training_jit_compile: bool,
+            training_update_to_data_ratio: float,
+            training_updates_per_call: int,
             experience_buffer_args: dict,
             network_args: dict,
+            experience_buffer: ExperienceBuffer | None = None,  # share an existing buffer instead
+            reward_weightings: ndarray | None = None,  # train on rewards relabeled from reward components
+            reward_weightings_basis: ndarray | None = None,  # [num_objectives, num_components], see below
     ) -> None:
+        """
+        With a reward_weightings_basis, policy and value networks are conditioned on the reward weightings:
+        their inputs are the state followed by a weightings vector. Every training experience is relabeled with
+        its own weightings, sampled uniformly from the convex hull of the basis, so that one policy learns
+        the allocations for any mix of the basis objectives. Requires a buffer that stores reward components.
+        """
 
         def initialize_networks(
+                num_value_networks: int,
                 value_network_args: dict,
                 value_network_optimizer: callable,
                 value_network_optimizer_args: dict,
@@ -66,14 +85,13 @@ class TD3ActorCritic:
         ) -> None:
 
             # CREATE NETWORKS
-            # TODO: The number of networks should probably be part of config
-            for _ in range(2):
-                self.networks['value'].append(
-                    {
-                        'primary': ValueNetwork(**value_network_args),
-                        'target': ValueNetwork(**value_network_args),
-                    }
-                )
+            #  All value networks live in one ensemble model that is evaluated in a single pass
+            self.networks['value'].append(
+                {
+                    'primary': ValueNetworkEnsemble(num_networks=num_value_networks, **value_network_args),
+                    'target': ValueNetworkEnsemble(num_networks=num_value_networks, **value_network_args),
+                }
+            )
 
             for _ in range(1):
                 self.networks['policy'].append(
@@ -102,27 +120,40 @@ class TD3ActorCritic:
                     for network_rank, network in network_pair.items():
                         network.initialize_inputs(dummy_input)
                     network_pair['primary'].compile(optimizer=optimizer(**optimizer_args))
-            self.update_target_networks(tau_target_update=1.0)
-
-        self.rng: default_rng = rng
-        self.logger: Logger = parent_logger.getChild(__name__)
-
-        self.training_minimum_experiences: int = training_minimum_experiences
-        self.training_batch_size: int = training_batch_size
-        self.future_reward_discount_gamma: float = future_reward_discount_gamma
-        self.training_target_update_momentum_tau: float = training_target_update_momentum_tau
+            self.update_target_networks(tau_target_update=tf_constant(1.0))
+
+        super().__init__(
+            rng=rng,
+            parent_logger=parent_logger,
+            future_reward_discount_gamma=future_reward_discount_gamma,
+            training_minimum_experiences=training_minimum_experiences,
+            training_batch_size=training_batch_size,
+            training_target_update_momentum_tau=training_target_update_momentum_tau,
+            training_prefetch_batches=training_prefetch_batches,
+            training_update_to_data_ratio=training_update_to_data_ratio,
+            training_updates_per_call=training_updates_per_call,
+            experience_buffer_args=experience_buffer_args,
+            experience_buffer=experience_buffer,
+            reward_weightings=reward_weightings,
+        )
+        self.reward_weightings_basis = reward_weightings_basis
 
-        self.experience_buffer = ExperienceBuffer(**experience_buffer_args)
+        size_state = network_args['size_state']
+        if self.reward_weightings_basis is not None:
+            size_state += self.reward_weightings_basis.shape[1]  # the networks see the conditioned states
 
         self.networks: dict = {'value': [], 'policy': []}
-        initialize_networks(**network_args)
+        initialize_networks(**{**network_args, 'size_state': size_state})
+
+        self.build_train_graphs(size_state=size_state, num_actions=network_args['num_actions'],
+                                jit_compile=training_jit_compile)
 
         self.logger.info('TD3 initialized')
 
-    @tf_function
+    @tf_function(input_signature=[tf_TensorSpec(shape=[], dtype=tf_float32)])
     def update_target_networks(
             self,
-            tau_target_update: float
+            tau_target_update,  # float32 scalar tensor, python floats are converted by the signature
     ) -> None:
 
         for network_list in self.networks.values():
@@ -140,35 +171,65 @@ class TD3ActorCritic:
             for network_pair_id in range(len(network_list)):
                 network_list[network_pair_id]['target'].save(Path(model_path, f'{network_type}_{network_pair_id}'))
 
-    def load_policy(
+    def sample_reward_weightings(
             self,
-            model_path: Path,
-    ) -> None:
-        # TODO: You want to figure out in which way to load these here, e.g., full path as input?
-        for network_pair in self.networks['policy']:
-            network_pair['primary'] = load_model(Path(model_path, 'policy'))
-            network_pair['target'] = load_model(Path(model_path, 'policy'))
-            self.logger.error('this isnt fully implemented, stop')
-            exit()
+            num_samples: int,
+            rng: Generator | None = None,  # by default the allocator's rng
+    ) -> ndarray:
+        """
+        Weightings uniformly distributed over the convex hull of the reward_weightings_basis.
+        """
+
+        rng = rng if rng is not None else self.rng
+        mixtures = rng.dirichlet(ones(self.reward_weightings_basis.shape[0]), size=num_samples)
+
+        return (mixtures @ self.reward_weightings_basis).astype('float32')
+
+    def condition_on_reward_weightings(
+            self,
+            states: ndarray,  # [..., size_state]
+            reward_weightings: ndarray,  # [num_components], or one per state [..., num_components]
+    ) -> ndarray:
+
+        reward_weightings = broadcast_to(reward_weightings, (*states.shape[:-1], reward_weightings.shape[-1]))
+
+        return concatenate([states, reward_weightings], axis=-1, dtype='float32')
 
     def get_action(
             self,
             state,
+            reward_weightings: ndarray | None = None,  # required by a reward weightings conditioned policy
     ) -> ndarray:
 
+        if self.reward_weightings_basis is not None:
+            if reward_weightings is None:
+                raise ValueError('the policy is conditioned on reward weightings, pass reward_weightings')
+            state = self.condition_on_reward_weightings(states=state, reward_weightings=reward_weightings)
         if state.ndim == 1:
             state = state[newaxis]
         action = self.networks['policy'][0]['primary'].call(state)
         return action.numpy().flatten()
 
-    def add_experience(
+    def get_graph_functions(
             self,
-            experience: dict,
-    ) -> None:
-        self.experience_buffer.add_experience(experience=experience)
+    ) -> dict:
+        """
+        All traced functions of this allocator by name, e.g., to monitor retracing.
+        """
+
+        graph_functions = {
+            'train_graph': self.train_graph,
+            'train_many_graph': self.train_many_graph,
+            'update_target_networks': self.update_target_networks,
+        }
+        for network_type, network_list in self.networks.items():
+            for network_pair_id, network_pair in enumerate(network_list):
+                for network_rank, network in network_pair.items():
+                    graph_functions[f'{network_type}_{network_pair_id}_{network_rank}.call'] = network.call
+
+        return graph_functions
 
-    @tf_function
-    def train_graph(
+    def train_step(
             self,
             states,
             actions,
@@ -176,8 +237,6 @@ class TD3ActorCritic:
             next_states,
             sample_importance_weights,
     ):
-        # TODO: This is hardcoded for two value nets because tf minimum function is weird
-
         # TRAIN VALUE NETWORKS
         target_q = rewards
         # get future reward estimate
@@ -192,18 +251,18 @@ class TD3ActorCritic:
             # next_actions = tf_linalg.normalize(next_actions, axis=1, ord=1)[0]  # re-normalize
             # Clipping so that the extra net won't introduce more overestimation
             input_vector = tf_concat([next_states, next_actions], axis=1)
-            q_estimate_1 = self.networks['value'][0]['target'].call(input_vector)
-            q_estimate_2 = self.networks['value'][1]['target'].call(input_vector)
-            conservative_q_estimate = tf_squeeze(tf_minimum(q_estimate_1, q_estimate_2))
+            q_estimates = self.networks['value'][0]['target'].call(input_vector)  # [num_value_networks, batch, 1]
+            conservative_q_estimate = tf_squeeze(tf_reduce_min(q_estimates, axis=0))
             target_q = target_q + self.future_reward_discount_gamma * conservative_q_estimate
 
         input_vector = tf_concat([states, actions], axis=1)
         for network_pair in self.networks['value']:
             with tf_GradientTape() as tape:  # autograd
-                estimate = tf_squeeze(network_pair['primary'].call(input_vector))
-                td_error = tf_math.subtract(target_q, estimate)
-                loss_estimation = tf_reduce_mean(
-                    sample_importance_weights * td_error ** 2
+                estimates = tf_squeeze(network_pair['primary'].call(input_vector), axis=-1)
+                td_errors = tf_math.subtract(target_q, estimates)  # [num_value_networks, batch]
+                # each member only depends on its own loss, summing them trains all members at once
+                loss_estimation = tf_reduce_sum(
+                    tf_reduce_mean(sample_importance_weights * td_errors ** 2, axis=1)
                 )
                 loss = (
                     loss_estimation
@@ -222,9 +281,9 @@ class TD3ActorCritic:
                 value_network_input = tf_concat([input_vector, actor_actions], axis=1)
                 # Original Paper, DDPG Paper and other implementations train on primary network. Why?
                 #  Because otherwise the value net is always one gradient step behind
-                # TODO: This always uses the first value network
+                # Like TD3, the actor follows the first value network only, evaluated on its slice of the ensemble
                 value_network_score = tf_reduce_mean(
-                    self.networks['value'][0]['primary'].call(value_network_input)
+                    self.networks['value'][0]['primary'].call_member(value_network_input, member_id=0)
                 )
                 loss = (
                     - value_network_score
@@ -235,36 +294,32 @@ class TD3ActorCritic:
             network_pair['primary'].optimizer.apply_gradients(  # apply gradient update
                 zip(gradients, network_pair['primary'].trainable_variables))
 
-        self.update_target_networks(tau_target_update=self.training_target_update_momentum_tau)
+        self.update_target_networks(tau_target_update=tf_constant(self.training_target_update_momentum_tau))
         # TODO: i think we're not adjusting the priorities anywhere for prio exp replay
 
-    def train(
+    def sample_experiences(
             self,
-    ) -> None:
-
-        if (self.experience_buffer.get_len() < self.training_minimum_experiences) or (
-                self.experience_buffer.get_len() < self.training_batch_size):
-            return
-
-        # SAMPLE FROM BUFFER
+            num_experiences: int,
+            rng: Generator | None = None,  # by default the allocator's rng
+    ) -> tuple[dict, ndarray]:
+        """
+        With a reward_weightings_basis, every experience is relabeled with its own sampled weightings,
+        and its state and next_state are conditioned on them.
+        """
+
+        if self.reward_weightings_basis is None:
+            return super().sample_experiences(num_experiences=num_experiences, rng=rng)
+
+        reward_weightings = self.sample_reward_weightings(num_samples=num_experiences, rng=rng)
         (
             sample_experiences,
             sample_experience_ids,
             sample_importance_weights,
-        ) = self.experience_buffer.sample(batch_size=self.training_batch_size)
-
-        states = tf_constant([experience['state'] for experience in sample_experiences], dtype=tf_float32)
-        actions = tf_constant([experience['action'] for experience in sample_experiences], dtype=tf_float32)
-        rewards = tf_constant([experience['reward'] for experience in sample_experiences], dtype=tf_float32)
-        next_states = tf_constant([experience['next_state'] for experience in sample_experiences], dtype=tf_float32)
-        sample_importance_weights = tf_constant(sample_importance_weights, dtype=tf_float32)
-
-        self.train_graph(
-            states=states,
-            actions=actions,
-            rewards=rewards,
-            next_states=next_states,
-            sample_importance_weights=sample_importance_weights,
-        )
-
-
+        ) = self.experience_buffer.sample(batch_size=num_experiences,
+                                          reward_weightings=reward_weightings,
+                                          rng=rng)
+        for key in ['state', 'next_state']:
+            sample_experiences[key] = self.condition_on_reward_weightings(states=sample_experiences[key],
+                                                                          reward_weightings=reward_weightings)
+
+        return sample_experiences, sample_importance_weights
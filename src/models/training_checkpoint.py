@@ -0,0 +1,83 @@
+
+from json import (
+    dump as json_dump,
+    load as json_load,
+)
+from pathlib import (
+    Path,
+)
+from shutil import (
+    rmtree,
+)
+from numpy import (
+    savez as np_savez,
+    load as np_load,
+)
+
+from src.models.experience_buffer import (
+    ExperienceBuffer,
+)
+
+
+def write_training_checkpoint(
+        checkpoint_path: Path,
+        runner_state: dict,  # json serializable
+        allocator_states: dict,  # objective name -> allocator.get_training_state()
+        experience_buffer_snapshot: dict,  # experience_buffer.get_snapshot()
+) -> None:
+    """
+    Write a full training checkpoint. Files are first written to a temporary folder, so an interrupted
+    write keeps the previous checkpoint intact.
+    """
+
+    temporary_path = Path(checkpoint_path.parent, f'{checkpoint_path.name}_tmp')
+    rmtree(temporary_path, ignore_errors=True)
+    temporary_path.mkdir(parents=True)
+
+    # files are numbered in objective order, objective names may be training names that contain path separators
+    array_counts = {}
+    for objective_id, (objective_name, allocator_state) in enumerate(allocator_states.items()):
+        np_savez(
+            Path(temporary_path, f'allocator_{objective_id}.npz'),
+            **{f'{name}.{array_id}': values
+               for name, arrays in allocator_state['arrays'].items()
+               for array_id, values in enumerate(arrays)},
+        )
+        array_counts[objective_name] = {name: len(arrays) for name, arrays in allocator_state['arrays'].items()}
+
+    with open(Path(temporary_path, 'runner.json'), 'w') as file:
+        json_dump({
+            'runner_state': runner_state,
+            'training_update_credits': {objective_name: allocator_state['training_update_credit']
+                                        for objective_name, allocator_state in allocator_states.items()},
+            'array_counts': array_counts,
+        }, file, indent=4)
+
+    ExperienceBuffer.write_snapshot(snapshot=experience_buffer_snapshot,
+                                    buffer_path=Path(temporary_path, 'experience_buffer'))
+
+    rmtree(checkpoint_path, ignore_errors=True)
+    temporary_path.rename(checkpoint_path)
+
+
+def load_training_checkpoint(
+        checkpoint_path: Path,
+) -> tuple[dict, dict]:
+    """
+    Read the runner state and the allocator states of a checkpoint written by write_training_checkpoint.
+    The experience buffer is restored via ExperienceBuffer.load from checkpoint_path / experience_buffer.
+    """
+
+    with open(Path(checkpoint_path, 'runner.json'), 'r') as file:
+        checkpoint = json_load(file)
+
+    allocator_states = {}
+    for objective_id, (objective_name, array_counts) in enumerate(checkpoint['array_counts'].items()):
+        with np_load(Path(checkpoint_path, f'allocator_{objective_id}.npz')) as arrays:
+            allocator_states[objective_name] = {
+                'arrays': {name: [arrays[f'{name}.{array_id}'] for array_id in range(num_arrays)]
+                           for name, num_arrays in array_counts.items()},
+                'training_update_credit': checkpoint['training_update_credits'][objective_name],
+            }
+
+    return checkpoint['runner_state'], allocator_states
@@ -2,18 +2,31 @@
 import matplotlib.pyplot as plt
 from numpy import (
     ndarray,
+    array,
+    vstack,
+    newaxis,
+    where,
     infty,
+    nan,
     ones,
     mean,
+    nanmean,
+    abs as np_abs,
+    sum as np_sum,
+)
+from numpy.random import (
+    Generator,
 )
 from datetime import (
     datetime,
 )
+from time import (
+    perf_counter,
+)
 from pathlib import (
     Path,
 )
 from shutil import (
-    copytree,
     rmtree,
 )
 
@@ -23,49 +36,94 @@ from src.config.config import (
 from src.data.scheduling_data import (
     SchedulingData,
 )
+from src.models.experience_buffer import (
+    ExperienceBuffer,
+)
 from src.models.td3 import (
     TD3ActorCritic,
 )
+from src.models.soft_actor_critic import (
+    SoftActorCritic,
+)
+from src.models.numpy_policy import (
+    NumpyPolicy,
+)
+from src.models.checkpoint_writer import (
+    CheckpointWriter,
+)
+from src.models.training_checkpoint import (
+    write_training_checkpoint,
+    load_training_checkpoint,
+)
+from src.models.policy_snapshot import (
+    write_policy_snapshot,
+)
+from src.utils.retrace_monitor import (
+    RetraceMonitor,
+)
 
 
-class TrainingRunner:
-    def __init__(
-            self,
-    ) -> None:
+def add_random_distribution(
+        rng: Generator,
+        action: ndarray,  # turns out its much faster to numpy the tensor and then do operations on ndarray
+        tau_momentum: float,  # tau * random_distribution + (1 - tau) * action
+) -> ndarray:
+    """
+    Mix an action vector with a random_uniform vector of same length
+    by tau * random_distribution + (1 - tau) * action
+    """
+    if tau_momentum == 0.0:
+        return action
 
-        self.config = Config()
-        self.rng = self.config.rng
+    # create random action
+    random_distribution = rng.random(size=len(action), dtype='float32')
+    random_distribution = random_distribution / sum(random_distribution)
 
-    def add_random_distribution(
-            self,
-            action: ndarray,  # turns out its much faster to numpy the tensor and then do operations on ndarray
-            tau_momentum: float,  # tau * random_distribution + (1 - tau) * action
-    ) -> ndarray:
-        """
-        Mix an action vector with a random_uniform vector of same length
-        by tau * random_distribution + (1 - tau) * action
-        """
-        if tau_momentum == 0.0:
-            return action
+    # combine
+    noisy_action = tau_momentum * random_distribution + (1 - tau_momentum) * action
+
+    # normalize
+    sum_noisy_action = sum(noisy_action)
+    if sum_noisy_action != 0:
+        noisy_action = noisy_action / sum_noisy_action
 
-        # create random action
-        random_distribution = self.rng.random(size=sum(self.config.num_users.values()), dtype='float32')
-        random_distribution = random_distribution / sum(random_distribution)
+    return noisy_action
 
-        # combine
-        noisy_action = tau_momentum * random_distribution + (1 - tau_momentum) * action
 
-        # normalize
-        sum_noisy_action = sum(noisy_action)
-        if sum_noisy_action != 0:
-            noisy_action = noisy_action / sum_noisy_action
+class TrainingRunner:
+    def __init__(
+            self,
+            config: Config | None = None,  # by default a fresh Config
+    ) -> None:
 
-        return noisy_action
+        self.config = config if config is not None else Config()
+        self.rng = self.config.rng
 
     def train(
             self,
             training_name: str,
+            resume: bool = False,  # continue from the checkpoint, or the experience buffer, of training_name
+            multi_objective: bool = False,  # train one allocator per config.reward_weightings_per_objective
+            reward_conditioned: bool = False,  # train one allocator for any mix of these objectives
+            warm_start_policy_path: Path | None = None,  # fine-tune from this policy snapshot or SavedModel policy
+            episode_callback: callable = None,  # (episode_id, reward_per_step per objective) -> True stops training
+            show_plot: bool = True,
     ) -> None:
+        """
+        Train allocators on the scheduling sim. In multi objective mode, experiences store the unweighted
+        reward components and one allocator per objective samples from the same shared experience buffer,
+        relabeling rewards with its own reward weightings. The allocators take turns acting.
+        In reward conditioned mode, experiences store the reward components as well, and one td3 allocator
+        is conditioned on reward weightings mixed from config.reward_weightings_per_objective. It acts with
+        weightings sampled per episode, checkpoints are scored by a separate pass on fixed evaluation states
+        that acts with config.reward_weightings. The mixed rows are scaled to comparable reward magnitudes.
+        Every config.checkpoint_interval_episodes, a full training checkpoint of networks, optimizer slots,
+        experience buffer, rng, exploration noise and episode counter is written on a background thread.
+        The sim itself restarts from a fresh state on resume.
+        With warm_start_policy_path, all allocators start from the weights of that policy, a resumed
+        checkpoint takes precedence.
+        """
+
         def progress_print() -> None:
             progress = (episode_id * self.config.num_steps_per_episode + step_id + 1) / self.config.steps_total
             timedelta = datetime.now() - real_time_start
@@ -89,117 +147,378 @@ class TrainingRunner:
 
             return exploration_noise_momentum_new
 
-        def save_model_checkpoint(extra=None):
+        def save_model_checkpoint(objective_name, extra=None):
+            # capture the policy weights on this thread, write and prune snapshots in the background
+            time_start = perf_counter()
 
             name = f'policy_snap_{extra:.3f}'
             checkpoint_path = Path(
-                self.config.models_path,
-                training_name,
+                objective_paths[objective_name],
                 name,
             )
 
-            allocator.networks['policy'][0]['primary'].save(checkpoint_path)
-
-            # save config
-            copytree(Path(self.config.project_root_path, 'src', '../config'),
-                     Path(checkpoint_path, '../config'),
-                     dirs_exist_ok=True)
+            policy_network = allocators[objective_name].networks['policy'][0]['primary']
+            weights = policy_network.get_weights()
+            best_snapshots[objective_name] = (checkpoint_path, weights)
 
             # clean model checkpoints
-            for high_score_prior_id, high_score_prior in enumerate(reversed(high_scores)):
+            prior_checkpoint_paths = []
+            high_score = high_scores[objective_name][-1]
+            for high_score_prior_id, high_score_prior in enumerate(reversed(high_scores[objective_name][:-1])):
                 if high_score > 1.05 * high_score_prior or high_score_prior_id > 3:
 
                     name = f'policy_snap_{high_score_prior:.3f}'
 
-                    prior_checkpoint_path = Path(
-                        self.config.models_path,
-                        training_name,
+                    prior_checkpoint_paths.append(Path(
+                        objective_paths[objective_name],
                         name,
-                    )
+                    ))
+                    high_scores[objective_name].remove(high_score_prior)
+
+            snapshot_stall_seconds.append(perf_counter() - time_start)
+
+            def write() -> None:
+                write_policy_snapshot(snapshot_path=checkpoint_path,
+                                      weights=weights,
+                                      network_class_name=type(policy_network).__name__,
+                                      network_args={'num_actions': int(weights[-1].shape[-1]),
+                                                    **self.config.network_args['policy_network_args']},
+                                      config_path=Path(self.config.project_root_path, 'src', 'config'))
+                for prior_checkpoint_path in prior_checkpoint_paths:
                     rmtree(path=prior_checkpoint_path, ignore_errors=True)
-                    high_scores.remove(high_score_prior)
+
+            checkpoint_writer.submit(write=write,
+                                     description=f'{objective_name} policy snapshot {checkpoint_path.name}')
 
             return checkpoint_path
 
+        def save_experience_buffer() -> None:
+            experience_buffer.save(buffer_path=experience_buffer_path)
+
+        def save_training_checkpoint() -> None:
+            # capture host copies on this thread, serialize them in the background while training continues
+            time_start = perf_counter()
+            runner_state = {
+                'episode_id': episode_id,
+                'exploration_noise_momentum': exploration_noise_momentum,
+                'high_scores': {objective_name: [float(high_score) for high_score in objective_high_scores]
+                                for objective_name, objective_high_scores in high_scores.items()},
+                'reward_per_step': {objective_name: objective_reward_per_step.tolist()
+                                    for objective_name, objective_reward_per_step
+                                    in per_episode_metrics['reward_per_step'].items()},
+                'rng_state': self.rng.bit_generator.state,
+            }
+            allocator_states = {objective_name: allocator.get_training_state()
+                                for objective_name, allocator in allocators.items()}
+            experience_buffer_snapshot = experience_buffer.get_snapshot()
+            checkpoint_stall_seconds.append(perf_counter() - time_start)
+
+            checkpoint_writer.submit(
+                write=lambda: write_training_checkpoint(checkpoint_path=checkpoint_path,
+                                                        runner_state=runner_state,
+                                                        allocator_states=allocator_states,
+                                                        experience_buffer_snapshot=experience_buffer_snapshot),
+                description=f'training checkpoint after episode {episode_id}',
+            )
+
+        def evaluate_reward_conditioned_policy() -> float:
+            # the episodes act with sampled weightings, rank the policy acting with config.reward_weightings instead
+            allocator = allocators[training_name]
+            actions = allocator.networks['policy'][0]['primary'].call(
+                allocator.condition_on_reward_weightings(states=evaluation_states,
+                                                         reward_weightings=evaluation_reward_weightings)
+            ).numpy()
+            rewards, _ = sim.step_batched(states=evaluation_states, percentage_allocation_solutions=actions)
+
+            return float(mean(rewards))
+
         training_name = training_name
         real_time_start = datetime.now()
 
         sim = SchedulingData(config=self.config)
-        allocator = TD3ActorCritic(**self.config.td3_actor_critic_args)
-
-        exploration_noise_momentum = self.config.exploration_noise_momentum_initial
-
-        per_episode_metrics: dict = {
-            'reward_per_step': -infty * ones(self.config.num_episodes),
-            # 'value_loss_mean': +infty * ones(self.config.num_episodes),
-            # 'priority_timeouts_per_occurrence': +infty * ones(self.config.num_episodes),
-        }
-        high_score = -infty
-        high_scores = []
 
-        for episode_id in range(self.config.num_episodes):
+        if multi_objective and reward_conditioned:
+            raise ValueError('multi objective and reward conditioned training are exclusive')
+        if reward_conditioned and self.config.allocator_type == 'soft_actor_critic':
+            raise ValueError('reward conditioned training supports the td3 allocator only')
 
-            episode_metrics: dict = {
-                'rewards': -infty * ones(self.config.num_steps_per_episode),
-                # 'value_losses': +infty * ones(self.config.num_steps_per_episode),
-                # 'priority_timeouts': +infty * ones(self.config.num_steps_per_episode),
+        if multi_objective:
+            reward_weightings_per_objective = self.config.reward_weightings_per_objective
+            objective_paths = {
+                objective_name: Path(self.config.models_path, training_name, objective_name)
+                for objective_name in reward_weightings_per_objective.keys()
             }
-
-            step_experience: dict = {'state': 0, 'action': 0, 'reward': 0, 'next_state': 0}
-            state_next: ndarray = sim.get_state()
-
-            for step_id in range(self.config.num_steps_per_episode):
-
-                simulation_step = episode_id * self.config.num_steps_per_episode + step_id
-                # determine state
-                state_current = state_next
-                step_experience['state'] = state_current
-
-                # find allocation action based on state
-                bandwidth_allocation_solution = allocator.get_action(state_current)
-                noisy_bandwidth_allocation_solution = self.add_random_distribution(
-                    action=bandwidth_allocation_solution,
-                    tau_momentum=exploration_noise_momentum
-                )
-                step_experience['action'] = noisy_bandwidth_allocation_solution
-
-                # step simulation based on action
-                (
-                    step_reward,
-                    unweighted_step_reward_components,
-                ) = sim.step(
-                    percentage_allocation_solution=noisy_bandwidth_allocation_solution,
+        else:
+            reward_weightings_per_objective = {training_name: self.config.reward_weightings}
+            objective_paths = {training_name: Path(self.config.models_path, training_name)}
+
+        if self.config.allocator_type == 'soft_actor_critic':
+            allocator_class = SoftActorCritic
+            allocator_args = self.config.soft_actor_critic_args
+        else:
+            allocator_class = TD3ActorCritic
+            allocator_args = self.config.td3_actor_critic_args
+
+        experience_buffer = ExperienceBuffer(**allocator_args['experience_buffer_args'])
+        allocators: dict = {}
+        if reward_conditioned:
+            # Scale the basis rows to unit mean absolute reward of random allocations on fixed evaluation states,
+            # at their raw scales the sum rate objective dominates any mixture
+            evaluation_states = sim.sample_states(num_states=self.config.reward_conditioned_evaluation_num_states)
+            random_allocations = self.rng.random(evaluation_states.shape[:1] + (len(sim.users),), dtype='float32')
+            random_allocations = random_allocations / np_sum(random_allocations, axis=1, keepdims=True)
+            _, random_reward_components = sim.step_batched(states=evaluation_states,
+                                                           percentage_allocation_solutions=random_allocations)
+            random_reward_components = vstack([random_reward_components[component_key]
+                                               for component_key in sim.reward_component_keys.values()]).T
+            reward_weightings_vectors = array([
+                sim.get_reward_weightings_vector(reward_weightings)
+                for reward_weightings in [*self.config.reward_weightings_per_objective.values(),
+                                          self.config.reward_weightings]
+            ])
+            reward_scales = mean(np_abs(random_reward_components @ reward_weightings_vectors.T), axis=0)
+            reward_weightings_vectors = (reward_weightings_vectors
+                                         / where(reward_scales > 0, reward_scales, 1)[:, newaxis]).astype('float32')
+            evaluation_reward_weightings = reward_weightings_vectors[-1]
+
+            allocators[training_name] = allocator_class(
+                **allocator_args,
+                experience_buffer=experience_buffer,
+                reward_weightings_basis=reward_weightings_vectors[:-1],
+            )
+        else:
+            for objective_name, reward_weightings in reward_weightings_per_objective.items():
+                allocators[objective_name] = allocator_class(
+                    **allocator_args,
+                    experience_buffer=experience_buffer,
+                    reward_weightings=sim.get_reward_weightings_vector(reward_weightings) if multi_objective else None,
                 )
-                step_experience['reward'] = step_reward
-
-                # determine new state
-                state_next = sim.get_state()
-                step_experience['next_state'] = state_next
-
-                # save tuple (S, A, r, S_{new})
-                allocator.add_experience(experience=step_experience)
-
-                # train allocator off-policy
-                allocator.train()
-
-                # anneal parameters
-                exploration_noise_momentum = anneal_parameters()
-
-                # log step results
-                episode_metrics['rewards'][step_id] = step_experience['reward']
+        store_reward_components = multi_objective or reward_conditioned
+        acting_order = list(allocators.keys())
+        if warm_start_policy_path is not None:
+            for allocator in allocators.values():
+                allocator.load_policy(policy_path=warm_start_policy_path)
+
+        # Acting via numpy copies of the policies skips the tensorflow dispatch on every step
+        numpy_policies: dict = {}
+        if self.config.numpy_policy_sync_interval > 0:
+            if self.config.allocator_type == 'soft_actor_critic':
+                raise ValueError('numpy policy inference supports the deterministic td3 policy only')
+            numpy_policies = {
+                objective_name: NumpyPolicy.from_keras(allocator.networks['policy'][0]['primary'])
+                for objective_name, allocator in allocators.items()
+            }
 
-                if step_id % 50 == 0:
-                    progress_print()
+        # All graphs are traced during the first episode, including for saving checkpoints. Retracing later is slow
+        retrace_monitor = RetraceMonitor(parent_logger=self.config.logger)
+        for objective_name, allocator in allocators.items():
+            retrace_monitor.register(allocator.get_graph_functions(), prefix=f'{objective_name}: ')
 
-            per_episode_metrics['reward_per_step'][episode_id] = (
-                    sum(episode_metrics['rewards']) / self.config.num_steps_per_episode
-            )
-            print('\n')
+        exploration_noise_momentum = self.config.exploration_noise_momentum_initial
 
-            if per_episode_metrics['reward_per_step'][episode_id] > high_score:
-                high_score = per_episode_metrics['reward_per_step'][episode_id]
-                high_scores.append(high_score)
-                save_model_checkpoint(high_score)
+        per_episode_metrics: dict = {
+            'reward_per_step': {
+                objective_name: -infty * ones(self.config.num_episodes)
+                for objective_name in allocators.keys()
+            },
+            # 'value_loss_mean': +infty * ones(self.config.num_episodes),
+            # 'priority_timeouts_per_occurrence': +infty * ones(self.config.num_episodes),
+        }
+        high_scores: dict = {objective_name: [] for objective_name in allocators.keys()}
+
+        experience_buffer_path = Path(self.config.models_path, training_name, 'experience_buffer')
+        checkpoint_path = Path(self.config.models_path, training_name, 'checkpoint')
+        checkpoint_writer = CheckpointWriter(parent_logger=self.config.logger)
+        checkpoint_stall_seconds: list = []
+        snapshot_stall_seconds: list = []
+        best_snapshots: dict = {}  # objective name -> (path, weights) of the latest high score policy snapshot
+        start_episode_id = 0
+        if resume and Path(checkpoint_path, 'runner.json').is_file():
+            runner_state, allocator_states = load_training_checkpoint(checkpoint_path=checkpoint_path)
+            for objective_name, allocator in allocators.items():
+                allocator.set_training_state(allocator_states[objective_name])
+            experience_buffer.load(buffer_path=Path(checkpoint_path, 'experience_buffer'))
+            self.rng.bit_generator.state = runner_state['rng_state']
+            exploration_noise_momentum = runner_state['exploration_noise_momentum']
+            high_scores = runner_state['high_scores']
+            for objective_name, reward_per_step in runner_state['reward_per_step'].items():
+                per_episode_metrics['reward_per_step'][objective_name][:len(reward_per_step)] = reward_per_step
+            start_episode_id = runner_state['episode_id'] + 1
+            self.config.logger.info(f'Resumed from {checkpoint_path} at episode {start_episode_id}')
+        elif resume:
+            experience_buffer.load(buffer_path=experience_buffer_path)
+            self.config.logger.info(f'Restored {experience_buffer.get_len()} experiences '
+                                    f'from {experience_buffer_path}')
+        if start_episode_id >= self.config.num_episodes:
+            self.config.logger.info(f'Training {training_name} already complete, '
+                                    f'checkpoint at episode {start_episode_id - 1}')
+            return
+
+        try:
+            for episode_id in range(start_episode_id, self.config.num_episodes):
+
+                episode_metrics: dict = {
+                    'rewards': -infty * ones(self.config.num_steps_per_episode),
+                    # each objective's reward on the steps where its allocator acted
+                    'objective_rewards': {
+                        objective_name: nan * ones(self.config.num_steps_per_episode)
+                        for objective_name in allocators.keys()
+                    },
+                    # 'value_losses': +infty * ones(self.config.num_steps_per_episode),
+                    # 'priority_timeouts': +infty * ones(self.config.num_steps_per_episode),
+                }
+
+                episode_reward_weightings = None
+                if reward_conditioned:
+                    episode_reward_weightings = allocators[training_name].sample_reward_weightings(num_samples=1)[0]
+                    self.config.logger.info(f'Episode {episode_id} reward weightings {episode_reward_weightings}')
+
+                if store_reward_components:
+                    step_experience: dict = {'state': 0, 'action': 0, 'reward_components': 0, 'next_state': 0}
+                else:
+                    step_experience: dict = {'state': 0, 'action': 0, 'reward': 0, 'next_state': 0}
+                state_next: ndarray = sim.get_state()
+
+                for step_id in range(self.config.num_steps_per_episode):
+
+                    simulation_step = episode_id * self.config.num_steps_per_episode + step_id
+                    acting_objective_name = acting_order[simulation_step % len(acting_order)]
+                    # determine state
+                    state_current = state_next
+                    step_experience['state'] = state_current
+
+                    # find allocation action based on state
+                    if numpy_policies:
+                        if simulation_step % self.config.numpy_policy_sync_interval == 0:
+                            for objective_name, numpy_policy in numpy_policies.items():
+                                numpy_policy.set_weights_from_keras(
+                                    allocators[objective_name].networks['policy'][0]['primary'])
+                        policy_input = state_current
+                        if reward_conditioned:
+                            policy_input = allocators[acting_objective_name].condition_on_reward_weightings(
+                                states=state_current, reward_weightings=episode_reward_weightings)
+                        bandwidth_allocation_solution = numpy_policies[acting_objective_name].get_action(policy_input)
+                    elif reward_conditioned:
+                        bandwidth_allocation_solution = allocators[acting_objective_name].get_action(
+                            state_current, reward_weightings=episode_reward_weightings)
+                    else:
+                        bandwidth_allocation_solution = allocators[acting_objective_name].get_action(state_current)
+                    noisy_bandwidth_allocation_solution = add_random_distribution(
+                        rng=self.rng,
+                        action=bandwidth_allocation_solution,
+                        tau_momentum=exploration_noise_momentum
+                    )
+                    step_experience['action'] = noisy_bandwidth_allocation_solution
+
+                    # step simulation based on action
+                    (
+                        step_reward,
+                        unweighted_step_reward_components,
+                    ) = sim.step(
+                        percentage_allocation_solution=noisy_bandwidth_allocation_solution,
+                    )
+                    if multi_objective:
+                        step_reward_components = sim.get_reward_components_vector(unweighted_step_reward_components)
+                        step_experience['reward_components'] = step_reward_components
+                        objective_reward = step_reward_components @ allocators[acting_objective_name].reward_weightings
+                    elif reward_conditioned:
+                        step_experience['reward_components'] = sim.get_reward_components_vector(
+                            unweighted_step_reward_components)
+                        objective_reward = step_reward
+                    else:
+                        step_experience['reward'] = step_reward
+                        objective_reward = step_reward
+
+                    # determine new state
+                    state_next = sim.get_state()
+                    step_experience['next_state'] = state_next
+
+                    # save tuple (S, A, r, S_{new})
+                    experience_buffer.add_experience(experience=step_experience)
+
+                    # train allocators off-policy
+                    for allocator in allocators.values():
+                        allocator.train_scheduled()
+
+                    # anneal parameters
+                    exploration_noise_momentum = anneal_parameters()
+
+                    # log step results
+                    episode_metrics['rewards'][step_id] = step_reward
+                    episode_metrics['objective_rewards'][acting_objective_name][step_id] = objective_reward
+
+                    if step_id % 50 == 0:
+                        progress_print()
+
+                print('\n')
+                for objective_name, allocator in allocators.items():
+                    if reward_conditioned:
+                        per_episode_metrics['reward_per_step'][objective_name][episode_id] = (
+                            evaluate_reward_conditioned_policy())
+                    else:
+                        per_episode_metrics['reward_per_step'][objective_name][episode_id] = nanmean(
+                            episode_metrics['objective_rewards'][objective_name]
+                        )
+                    self.config.logger.info(f'{objective_name}: {allocator.get_batch_stall_report()}')
+
+                    episode_reward_per_step = per_episode_metrics['reward_per_step'][objective_name][episode_id]
+                    if not high_scores[objective_name] or episode_reward_per_step > high_scores[objective_name][-1]:
+                        high_scores[objective_name].append(episode_reward_per_step)
+                        save_model_checkpoint(objective_name, episode_reward_per_step)
+
+                if self.config.checkpoint_interval_episodes > 0:
+                    if (episode_id + 1) % self.config.checkpoint_interval_episodes == 0:
+                        save_training_checkpoint()
+                else:
+                    save_experience_buffer()
+
+                if episode_id == start_episode_id:
+                    retrace_monitor.end_warmup()
+                else:
+                    retrace_monitor.check()
+
+                if episode_callback is not None and episode_callback(
+                        episode_id,
+                        {objective_name: per_episode_metrics['reward_per_step'][objective_name][episode_id]
+                         for objective_name in allocators.keys()},
+                ):
+                    self.config.logger.info(f'Training stopped by episode callback after episode {episode_id}')
+                    break
+        except KeyboardInterrupt:
+            # keep collected experience so that a resumed run can skip the warm-up. Resume prefers the
+            # training checkpoint, the interrupted episode counts as done
+            if self.config.checkpoint_interval_episodes > 0:
+                save_training_checkpoint()
+            else:
+                save_experience_buffer()
+            checkpoint_writer.wait()
+            raise
+        finally:
+            for allocator in allocators.values():
+                allocator.stop_batch_prefetcher()
+
+        checkpoint_writer.wait()
+        if snapshot_stall_seconds:
+            self.config.logger.info(f'Policy snapshots: {len(snapshot_stall_seconds)} written, training stalled '
+                                    f'{1_000 * mean(snapshot_stall_seconds):.2f} ms per snapshot for capturing')
+        if self.config.snapshot_export_saved_model:
+            # full SavedModel of the best snapshot next to its weights, loadable without this code base
+            for objective_name, (snapshot_path, snapshot_weights) in best_snapshots.items():
+                policy_network = allocators[objective_name].networks['policy'][0]['primary']
+                live_weights = policy_network.get_weights()
+                policy_network.set_weights(snapshot_weights)
+                policy_network.save(snapshot_path)
+                policy_network.set_weights(live_weights)
+        if checkpoint_stall_seconds:
+            self.config.logger.info(
+                f'Training checkpoints: {len(checkpoint_stall_seconds)} written, '
+                f'training stalled {1_000 * mean(checkpoint_stall_seconds):.1f} ms per checkpoint for capturing, '
+                f'{checkpoint_writer.seconds_writing / max(checkpoint_writer.num_writes, 1):.2f} s of writing '
+                f'per checkpoint in background')
+        self.config.logger.info(f'Graph tracing:\n{retrace_monitor.get_report()}')
+
+        if not show_plot:
+            return
 
         fig, ax = plt.subplots()
         sliding_window_average_rewards: ndarray = -infty * ones(len(episode_metrics['rewards']))
@@ -0,0 +1,29 @@
+
+from time import (
+    perf_counter,
+)
+from numpy import (
+    ndarray,
+    median,
+)
+
+
+def measure_latency_us(
+        get_action: callable,  # state -> action
+        states: ndarray,
+        num_warmup_states: int = 10,
+) -> float:
+    """
+    Median latency of one decision in microseconds.
+    """
+
+    for state in states[:num_warmup_states]:
+        get_action(state)
+
+    latencies = []
+    for state in states:
+        time_start = perf_counter()
+        get_action(state)
+        latencies.append(perf_counter() - time_start)
+
+    return 1_000_000 * float(median(latencies))
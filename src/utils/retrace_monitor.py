@@ -0,0 +1,73 @@
+
+from logging import (
+    Logger,
+)
+
+
+class RetraceMonitor:
+    """
+    Counts the traces of registered tf.functions. Every trace rebuilds the graph, which is slow, so after
+    warm-up each function should be traced already. check() warns about any function that traced again
+    since end_warmup().
+    """
+
+    def __init__(
+            self,
+            parent_logger: Logger,
+    ) -> None:
+
+        self.logger: Logger = parent_logger.getChild(__name__)
+
+        self.graph_functions: dict = {}  # name -> tf.function
+        self.warmup_tracing_counts: dict = {}  # name -> num traces at the end of warm-up
+        self.reported_tracing_counts: dict = {}  # name -> num traces at the last warning
+
+    def register(
+            self,
+            graph_functions: dict,  # name -> tf.function
+            prefix: str = '',
+    ) -> None:
+        for name, graph_function in graph_functions.items():
+            self.graph_functions[f'{prefix}{name}'] = graph_function
+
+    def get_tracing_counts(
+            self,
+    ) -> dict:
+        return {
+            name: graph_function.experimental_get_tracing_count()
+            for name, graph_function in self.graph_functions.items()
+        }
+
+    def end_warmup(
+            self,
+    ) -> None:
+        self.warmup_tracing_counts = self.get_tracing_counts()
+        self.reported_tracing_counts = dict(self.warmup_tracing_counts)
+
+    def check(
+            self,
+    ) -> dict:
+        """
+        Warn once per new trace of any function after warm-up. Returns the num of traces after warm-up per function.
+        """
+
+        retraces = {}
+        for name, tracing_count in self.get_tracing_counts().items():
+            num_retraces = tracing_count - self.warmup_tracing_counts.get(name, 0)
+            if num_retraces > 0:
+                retraces[name] = num_retraces
+            if tracing_count > self.reported_tracing_counts.get(name, 0):
+                self.logger.warning(f'{name} retraced after warm-up, {num_retraces} retraces so far')
+                self.reported_tracing_counts[name] = tracing_count
+
+        return retraces
+
+    def get_report(
+            self,
+    ) -> str:
+        lines = []
+        for name, tracing_count in self.get_tracing_counts().items():
+            num_retraces = tracing_count - self.warmup_tracing_counts.get(name, tracing_count)
+            lines.append(f'{name}: {tracing_count} traces, {num_retraces} after warm-up')
+
+        return '\n'.join(lines)